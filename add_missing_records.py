@@ -1,47 +1,467 @@
-import json, re, time
-from algoliasearch.configs import SearchConfig
-from algoliasearch.search_client import SearchClient
+import os, io, csv, sys, gzip, json, time, zlib, random, threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import islice
 from algoliasearch.exceptions import RequestException
 from algoliasearch.exceptions import AlgoliaUnreachableHostException
+import algolia_clients
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Constants
+MAX_BATCH_RECORDS = 500  # Maximum number of records saved per request
+MAX_BATCH_BYTES = 5 * 1024 * 1024  # Maximum size of the records saved per request, as serialized JSON
+MAX_RETRIES = 6  # Number of retries of a request failing with a transient error (unreachable, rate limited, 5xx)
+BACKOFF_BASE = 1  # Seconds waited before the first retry, doubled for every next one
+BACKOFF_MAX = 60  # Maximum number of seconds waited before a retry
+
+
+class SendStats:
+    """Counts the batches, retries and splits of the requests of add_missing_records.py, shared by its threads."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.batch_records = []
+        self.batch_bytes = []
+        self.retries = 0
+        self.splits = 0
+        self.failed = 0
+
+    def add_batch(self, records, size):
+        with self.lock:
+            self.batch_records.append(records)
+            self.batch_bytes.append(size)
+
+    def add_retry(self):
+        with self.lock:
+            self.retries += 1
+
+    def add_split(self):
+        with self.lock:
+            self.splits += 1
+
+    def add_failed(self, records):
+        with self.lock:
+            self.failed += records
+
+    def report(self):
+        """Prints the sizes of the saved batches and the number of retries, splits and failed records."""
+        if self.batch_records:
+            print(f"saved {len(self.batch_records)} batches of {min(self.batch_records)} to {max(self.batch_records)} records "
+                  f"(average {sum(self.batch_records) / len(self.batch_records):.0f}), "
+                  f"{min(self.batch_bytes) / 1024:.1f} to {max(self.batch_bytes) / 1024:.1f} KB")
+        print(f"{self.retries} retries, {self.splits} rejected batches split in two, {self.failed} records failed")
+
+
+class CheckpointJournal:
+    """
+    Append-only journal of the batches a run has completed, kept next to the summary file so an interrupted run
+    can continue where it stopped. The first line describes the run (input file, index and batch size), every
+    following line is one completed batch with the number of missing and saved objects and the failed records.
+    Lines are flushed to disk as they are written, a line cut off by a crash is ignored when the journal is read.
+
+    Args:
+    path (str): Path to the journal file.
+    header (dict): Description of the run, a journal of a run with another header is not resumed.
+    """
+
+    def __init__(self, path, header):
+        self.path = path
+        self.header = header
+        self.file = None
+
+    def load(self):
+        """Returns the completed batches by batch number, empty if there is no journal of the same run."""
+        completed = {}
+        try:
+            with open(self.path) as f:
+                lines = f.read().splitlines()
+        except FileNotFoundError:
+            return completed
+        for n, line in enumerate(lines):
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:  # cut off by a crash
+                continue
+            if n == 0 and entry != self.header:
+                return completed
+            if n > 0:
+                completed[entry['batch']] = entry
+        return completed
+
+    def start(self, resume):
+        """Opens the journal to append to it, or starts a new one unless `resume` is True."""
+        self.file = open(self.path, 'a' if resume else 'w')
+        if not resume:
+            self.write(self.header)
+        elif self.file.tell() > 0:
+            with open(self.path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':  # end the line cut off by a crash
+                    self.file.write('\n')
+
+    def write(self, entry):
+        self.file.write(json.dumps(entry) + '\n')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def commit(self, batch, missing, saved, failed_records):
+        """Records a batch as completed: looked up and its missing records saved."""
+        self.write({'batch': batch, 'missing': missing, 'saved': saved, 'failed': failed_records})
+
+    def remove(self):
+        """Closes and removes the journal once the run is complete."""
+        self.file.close()
+        os.remove(self.path)
 
 
+def open_summary(path, mode='r'):
+    """
+    Opens a summary file as text, compressed with gzip if the path ends with '.gz' and with zstd if it ends
+    with '.zst' (needs the 'zstandard' package). `mode` is 'r', 'w' or 'a'.
+    """
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    if path.endswith('.zst'):
+        if zstandard is None:
+            raise ImportError("zstd compressed summaries need the 'zstandard' package, install it with: pip install zstandard")
+        raw = open(path, mode + 'b')
+        if mode == 'r':
+            return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True), encoding='utf-8')
+        return io.TextIOWrapper(zstandard.ZstdCompressor().stream_writer(raw), encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+def recover_summary(path):
+    """
+    Rewrites a gzip or zstd summary as one complete stream, keeping the lines that can be read. A crash leaves
+    the compressed stream without its end, a stream appended after it couldn't be read back. Every line is
+    flushed as it is written, so only a line cut off by the crash is lost.
+    """
+    if not path.endswith(('.gz', '.zst')) or not os.path.exists(path):
+        return
+    errors = (EOFError, OSError, zlib.error) + ((zstandard.ZstdError,) if zstandard is not None else ())
+    lines = []
+    try:
+        with open_summary(path) as f:
+            for line in f:
+                lines.append(line)
+    except errors:  # end of the stream cut off by a crash
+        pass
+    root, ext = os.path.splitext(path)
+    tmp_path = f"{root}.tmp{ext}"
+    with open_summary(tmp_path, 'w') as f:
+        f.writelines(line for line in lines if line.endswith('\n'))
+    os.replace(tmp_path, path)
+
+
+class SummaryWriter:
+    """
+    Writes the summary of a run as NDJSON through a single file handle, one compact JSON line per batch with the
+    number of checked, missing and saved objects and the missing and failed objectIDs. Every line is flushed
+    as it is written, so the summary matches the checkpoint journal after a crash. A resumed run appends to it,
+    a compressed summary is first rewritten as a complete stream (see recover_summary()).
+
+    Args:
+    path (str): Path to the summary file, compressed if it ends with '.gz' or '.zst', see open_summary().
+    append (bool): Append to an existing summary instead of overwriting it.
+    """
+
+    def __init__(self, path, append=False):
+        if append:
+            recover_summary(path)
+        self.file = open_summary(path, 'a' if append else 'w')
+
+    def write(self, record):
+        self.file.write(json.dumps(record, separators=(',', ':')) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def read_summary(path):
+    """Yields the batch records of a summary file, e.g. to audit a run."""
+    with open_summary(path) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
 
 def init_algolia_client(appId, apiKey, batch_size=500):
-    # Initialize the Algolia client
-    config = SearchConfig(appId, apiKey)
-    config.batch_size = batch_size
+    # Initialize the Algolia client, with pooled connections and call metrics (see algolia_clients.py)
+    return algolia_clients.create_search_client(appId, apiKey, batch_size)
 
-    client = SearchClient.create_with_config(config)
-    return client
+def record_size(record):
+    """Returns the size of a record as serialized JSON in bytes."""
+    return len(json.dumps(record).encode('utf-8'))
 
-def send_data_to_algolia(client, data, index_name, counter, exceeded_records):
-    
-    print(f"Sending data to Algolia: index {index_name} # records {len(data)}")
-    index = client.init_index(index_name)
-    try: 
-        res = index.save_objects(data)
+
+def split_batches(data, max_records=MAX_BATCH_RECORDS, max_bytes=MAX_BATCH_BYTES):
+    """Yields (batch, size in bytes) with at most `max_records` records and `max_bytes` bytes, a larger record gets its own batch."""
+    batch = []
+    size = 0
+    for record in data:
+        record_bytes = record_size(record)
+        if batch and (len(batch) >= max_records or size + record_bytes > max_bytes):
+            yield batch, size
+            batch = []
+            size = 0
+        batch.append(record)
+        size += record_bytes
+    if batch:
+        yield batch, size
+
+
+def is_transient(error):
+    """Returns True for errors worth retrying: unreachable hosts, rate limits and server errors."""
+    if isinstance(error, AlgoliaUnreachableHostException):
+        return True
+    status = getattr(error, 'status_code', None)
+    return status is not None and (status == 429 or status >= 500)
+
+
+def backoff_delay(attempt):
+    """Returns the seconds to wait before retry `attempt` (0 based): exponential, capped at BACKOFF_MAX, with full jitter."""
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def retry_transient(call, description, stats, client=None):
+    """
+    Returns the result of call(), retrying transient errors up to MAX_RETRIES times, other errors are raised.
+    The hosts of `client` (the client or index call() uses) are marked as up again before every retry,
+    see algolia_clients.reset_hosts().
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            return call()
+        except (RequestException, AlgoliaUnreachableHostException) as e:
+            if not is_transient(e) or attempt == MAX_RETRIES:
+                raise
+            delay = backoff_delay(attempt)
+            print(f"{description} failed ({e}), retry {attempt + 1} of {MAX_RETRIES} in {delay:.1f} seconds")
+            stats.add_retry()
+            time.sleep(delay)
+            if client is not None:
+                algolia_clients.reset_hosts(client)
+
+
+def save_batch(index, batch, size, stats):
+    """Saves a batch, retrying transient errors up to MAX_RETRIES times, other errors are raised."""
+    retry_transient(lambda: index.save_objects(batch), f"Saving {len(batch)} records", stats, index)
+    stats.add_batch(len(batch), size)
+
+
+def send_batch(index, batch, size, stats, exceeded_records):
+    """
+    Saves a batch and returns the number of saved records. A batch rejected as too big is split in two halves
+    that are saved separately, so only records that are too big on their own end up in `exceeded_records`.
+    """
+    try:
+        save_batch(index, batch, size, stats)
+        return len(batch)
     except RequestException as e:
+        if 'is too big' in str(e) and len(batch) > 1:
+            stats.add_split()
+            half = len(batch) // 2
+            return sum(send_batch(index, part, sum(record_size(record) for record in part), stats, exceeded_records)
+                       for part in (batch[:half], batch[half:]))
         if 'is too big' in str(e):
             print(f"Record too big: {e}")
-            for record in data:
-                try:
-                    index.save_object(record)
-                except RequestException as inner_e:
-                    print("Error saving individual record:", inner_e)
-                    exceeded_records.append(record)
         else:
             print("An unexpected error occurred:", e)
-            
     except AlgoliaUnreachableHostException as ue:
-        print("Algolia is unreachable, waiting 20 seconds:", ue)
-        time.sleep(20)
-        cnt, exc = send_data_to_algolia(client, data, index_name, counter, exceeded_records)
-        return (cnt, exc)
+        print(f"Algolia is still unreachable after {MAX_RETRIES} retries:", ue)
+    exceeded_records.extend(batch)
+    stats.add_failed(len(batch))
+    return 0
+
+
+def send_data_to_algolia(client, data, index_name, counter, exceeded_records, stats=None):
+    """
+    Saves the records to the index in batches of at most MAX_BATCH_RECORDS records and MAX_BATCH_BYTES bytes,
+    see send_batch() for rejected batches and save_batch() for retries.
+    Returns the counter increased by the number of saved records, and `exceeded_records` with the records that
+    couldn't be saved.
+    """
+    if stats is None:
+        stats = SendStats()
+    print(f"Sending data to Algolia: index {index_name} # records {len(data)}")
+    index = client.init_index(index_name)
+    for batch, size in split_batches(data):
+        counter += send_batch(index, batch, size, stats, exceeded_records)
+    return (counter, exceeded_records)
+
+
+def read_input_rows(input_file):
+    """
+    Yields (objectID, name) for every line of the input file, read with the csv module so quoted names
+    containing commas stay in one piece. The objectID is the last column, the name the columns before it.
+    The header line (an 'object_id' column) and empty lines are skipped.
+    """
+    with open(input_file, 'r', newline='') as f:
+        for row in csv.reader(f):
+            if not row:
+                continue
+            objectID = row[-1].strip()
+            if 'object_id' in objectID:
+                continue
+            yield objectID, ','.join(row[:-1])
+
+
+def merge_input_records(rows, name_att):
+    """
+    Returns the records to add by objectID, in the order the objectIDs first appear in `rows`, and the number
+    of duplicate lines. The names of duplicate objectIDs are merged into `name_att`, separated by ' | '.
+    Memory grows with the number of unique objectIDs, not with the number of lines.
+    """
+    object_dict = {}
+    count_duplicates = 0
+    for objectID, name in rows:
+        record = object_dict.get(objectID)
+        if record is None:
+            object_dict[objectID] = {'objectID': objectID, name_att: name}
+        else:
+            record[name_att] = record[name_att] + ' | ' + name
+            count_duplicates += 1
+    return object_dict, count_duplicates
+
+
+def get_objects_batch(index, batch):
+    """Looks up a batch of objectIDs in the index, only retrieving their objectID, runs in the lookup thread pool."""
+    return index.get_objects(batch, {
+        'attributesToRetrieve': ['objectID']
+    })
+
+
+def find_missing_ids(batch, result):
+    """
+    Returns the objectIDs of a batch that are not in the index, in batch order: the requested objectIDs that
+    get_objects didn't return. Missing objects come back as null entries of result['results'].
+    """
+    found = {obj['objectID'] for obj in result['results'] if obj}
+    return [objectID for objectID in batch if objectID not in found]
+
+
+def browse_object_ids(client, index_name, stats=None):
+    """
+    Returns the objectIDs of all objects in the index, browsing it once without retrieving any other attribute.
+    The browse starts over if it fails with a transient error.
+    """
+    if stats is None:
+        stats = SendStats()
+    index = client.init_index(index_name)
+    return retry_transient(lambda: {hit['objectID'] for hit in index.browse_objects({'attributesToRetrieve': ['objectID']})},
+                           'Browsing the index', stats, index)
+
+
+def iter_batches(items, size):
+    """Yields lists of at most `size` items."""
+    items = iter(items)
+    while True:
+        batch = list(islice(items, size))
+        if not batch:
+            return
+        yield batch
+
+
+def find_and_add_missing(client, index_name, object_dict, summary, stats=None, journal=None, completed=(), existing_ids=None):
+    """
+    Looks up all objectIDs of `object_dict` in the index, LOOKUP_BATCH_SIZE at a time, and saves the records
+    that aren't in it. Every batch is written to the `summary` (a SummaryWriter) once it is done.
+    With `existing_ids`, the objectIDs of the whole index (see browse_object_ids), the missing records are
+    found without looking them up, so only the saves call the API.
+    Lookups and saves run in two thread pools: up to MAX_LOOKUPS_IN_FLIGHT batches are looked up ahead while the
+    missing records of earlier batches are saved. Results are handled in batch order, a batch without missing
+    records is completed after the saves of the batches before it, and once MAX_WRITES_IN_FLIGHT saves are running
+    the next batch waits for the oldest one, so the lookups can't run away from the saves.
+    Every batch is committed to the `journal` once it is done, batches in `completed` are skipped.
+    Returns the number of missing objects, the number of saved objects and the records that couldn't be saved.
+    """
+    if stats is None:
+        stats = SendStats()
+    index = client.init_index(index_name)
+    total_count = 0
+    count = 0
+    failed_records = []
+    batches = enumerate(iter_batches(object_dict, LOOKUP_BATCH_SIZE))
+    lookups = deque()
+    writes = deque()
+
+    def lookup_missing(batch):
+        if existing_ids is not None:
+            return [objectID for objectID in batch if objectID not in existing_ids]
+        result = retry_transient(lambda: get_objects_batch(index, batch), f"Looking up {len(batch)} objectIDs", stats, index)
+        return find_missing_ids(batch, result)
+
+    def submit_lookups():
+        while len(lookups) < MAX_LOOKUPS_IN_FLIGHT:
+            i, batch = next(batches, (None, None))
+            if batch is None:
+                return
+            if i in completed:
+                continue
+            if existing_ids is None:
+                print('getting objects from Algolia index, batch {} of {}'.format(i * LOOKUP_BATCH_SIZE, len(object_dict)))
+            lookups.append((i, len(batch), lookup_pool.submit(lookup_missing, batch)))
+
+    def complete_batch(i, checked, missing_ids, saved, failed):
+        summary.write({
+            'batch': i,
+            'checked': checked,
+            'missing': len(missing_ids),
+            'saved': saved,
+            'missing_ids': missing_ids,
+            'failed_ids': [record['objectID'] for record in failed],
+        })
+        if journal is not None:
+            journal.commit(i, len(missing_ids), saved, failed)
+
+    def finish_write():
+        nonlocal count
+        i, checked, missing_ids, future = writes.popleft()
+        saved, failed = future.result()
+        count += saved
+        failed_records.extend(failed)
+        complete_batch(i, checked, missing_ids, saved, failed)
+
+    with ThreadPoolExecutor(max_workers=MAX_LOOKUPS_IN_FLIGHT) as lookup_pool, ThreadPoolExecutor(max_workers=MAX_WRITES_IN_FLIGHT) as write_pool:
+        submit_lookups()
+        while lookups:
+            i, checked, future = lookups.popleft()
+            missing_ids = future.result()
+            submit_lookups()
+
+            if missing_ids:
+                print(f"{len(missing_ids)} of {checked} objects of batch {i} missing in Algolia index")
+            total_count += len(missing_ids)
+            missing_objects = [object_dict[objectID] for objectID in missing_ids]
+
+            #send missing objects to Algolia index, waiting for the oldest save if too many are running
+            if missing_objects:
+                while sum(not future.done() for *_, future in writes) >= MAX_WRITES_IN_FLIGHT:
+                    finish_write()
+                future = write_pool.submit(send_data_to_algolia, client, missing_objects, index_name, 0, [], stats)
+            else:
+                # queued behind the saves of earlier batches, so the summary and the journal stay in batch order
+                future = Future()
+                future.set_result((0, []))
+            writes.append((i, checked, missing_ids, future))
+            while writes and writes[0][3].done():
+                finish_write()
+
+        while writes:
+            finish_write()
+    return total_count, count, failed_records
 
 
 
 INPUT_FILE = input('Enter the path to the input file: ')
-OUTPUT_FILE = input('A summary file will be generated, enter the name of the output file: ')
+OUTPUT_FILE = input('A summary file will be generated (one JSON line per batch, end the name with .gz or .zst to compress it), enter the name of the output file: ')
 print('')
 print('Enter the Algolia credentials')
 APP_ID = input('Enter the Algolia APP ID: ')
@@ -50,89 +470,80 @@ INDEX_NAME = input('Enter the Algolia index name: ')
 print('')
 print('-- additional info --')
 name_att = input('Enter the name of the attribute that contains the name of the object: (default is "name"): ')
+NAME_ATT = 'name'
 if name_att not in ['', None]:
     NAME_ATT = name_att
+browse = input('Browse the whole index for its objectIDs instead of looking them up in batches? Fewer API calls if the file is large compared to the index (yes/no) [no]: ')
+BROWSE_INDEX = browse.strip().lower() == 'yes'
 
-BATCH_SIZE = 500
-
-objectIDs = []
-object_dict = {}
+BATCH_SIZE = MAX_BATCH_RECORDS  # Records per request of the client, send_data_to_algolia already splits batches to this size
+LOOKUP_BATCH_SIZE = 1000  # Number of objectIDs looked up per get_objects request
+MAX_LOOKUPS_IN_FLIGHT = 4  # Number of get_objects requests running at the same time
+MAX_WRITES_IN_FLIGHT = 2  # Number of batches of missing records being saved at the same time
 
 client = init_algolia_client(APP_ID, API_KEY, BATCH_SIZE)
+algolia_clients.install_metrics_export()
 
 index = client.init_index(INDEX_NAME)
-count_duplicates = 0
-# get all objectIDs from the CSV file, the object IDs are in column 0 of the CSV file
+# get all objectIDs from the CSV file, the object IDs are in the last column of the CSV file
 print('reading input file...')
-with open(INPUT_FILE, 'r') as f:
-    for line in f:
-        #skip the first line
-        objectID = str(line.split(',')[-1]).strip()
-        if 'object_id' in objectID:
-            continue
-
-        if objectID not in objectIDs:
-            objectIDs.append(objectID)
-            object_dict[objectID] = {'objectID': objectID, NAME_ATT: line[:-len(objectID)+1]}
-        else:
-            #print(f"Object already exists in the list: ", line)
-            record = object_dict[objectID]
-            record[NAME_ATT] = record[NAME_ATT] + ' | ' + line[:-len(objectID)+1]
-#            object_dict[objectID][NAME_ATT] = object_dict[objectID][NAME_ATT] + ' | ' + line[:-len(objectID)+1]
-            count_duplicates += 1
+object_dict, count_duplicates = merge_input_records(read_input_rows(INPUT_FILE), NAME_ATT)
 if count_duplicates > 0:
     print(f"found {count_duplicates} duplicate objects in the input file")
-    print(f"remaining objects: {len(objectIDs)}")
+    print(f"remaining objects: {len(object_dict)}")
+
+# a journal of the completed batches is kept next to the output file, to continue an interrupted run
+input_stat = os.stat(INPUT_FILE)
+journal = CheckpointJournal(f"{OUTPUT_FILE}.journal", {
+    'input_file': os.path.abspath(INPUT_FILE),
+    'input_size': input_stat.st_size,
+    'input_mtime': input_stat.st_mtime,
+    'index_name': INDEX_NAME,
+    'name_att': NAME_ATT,
+    'lookup_batch_size': LOOKUP_BATCH_SIZE,
+})
+completed = journal.load()
+resume = False
+if completed:
+    print(f'Found a checkpoint of an earlier run of this file with {len(completed)} completed batches, do you want to continue it?')
+    resume = input('yes/no: ') == 'yes'
+    if not resume:
+        completed = {}
 
 print('writing missing records to output file...')
-#check if output file exists and ask user if he wants to overwrite it
-try:
-    with open(OUTPUT_FILE, 'r') as f:
-        print('Output file already exists, do you want to overwrite it?')
-        overwrite = input('yes/no: ')
-        if overwrite == 'yes':
-            with open(OUTPUT_FILE, 'w') as f:
-                f.write('')
-        else:
-            print('Exiting')
-            exit()
-except:
-    print('Error opening output file, does not exist? Creating new file')
-
-# get the objects from Algolia index, retrieve batches of 1000 objects
-total_count = 0
-count = 0
-print('checking index, getting objectIDs 1000 at a time...')
-for i in range(0, len(objectIDs), 1000):
-    print('getting objects from Algolia index, batch {} of {}'.format(i, len(objectIDs)))
-    batch = objectIDs[i:i+1000]
-    result = index.get_objects(batch, {
-        'attributesToRetrieve': [NAME_ATT]
-    })
+#check if output file exists and ask user if he wants to overwrite it, a resumed run appends to it
+if not resume:
+    overwrite = 'yes'
+    try:
+        with open(OUTPUT_FILE, 'r') as f:
+            print('Output file already exists, do you want to overwrite it?')
+            overwrite = input('yes/no: ')
+    except FileNotFoundError:
+        print('Output file does not exist, creating new file')
+    if overwrite != 'yes':
+        print('Exiting')
+        sys.exit()
+journal.start(resume)
+summary = SummaryWriter(OUTPUT_FILE, append=resume)
 
-    #print('message: ', result['message'])
-
-    # Regular expression pattern to match numbers
-    pattern = r'ObjectID\s+(\w+)'
-
-    # Find all matches of the pattern in the string
-    numbers = re.findall(pattern, result['message'])
-    print(f"found {len(numbers)} objects in Algolia index")
-    total_count += len(numbers)
-    #write result to json file
-    with open(OUTPUT_FILE, 'a') as f:
-        json.dump(result, f, indent=4)
-
-    missing_objects = []
-    for number in numbers:
-        if str(number) not in object_dict:
-            print(f"Object with objectID {number} not found")
-            continue
-        missing_objects.append(object_dict[str(number)])
-    
-    #send missing objects to Algolia index
-    count, failed_records = send_data_to_algolia(client, missing_objects, INDEX_NAME, count, [])
+# get the objects from Algolia index, retrieve batches of 1000 objects or browse the whole index once
+send_stats = SendStats()
+existing_ids = None
+if BROWSE_INDEX:
+    print('browsing index for all objectIDs...')
+    existing_ids = browse_object_ids(client, INDEX_NAME, send_stats)
+    print(f"found {len(existing_ids)} objects in Algolia index")
+else:
+    print(f'checking index, getting objectIDs {LOOKUP_BATCH_SIZE} at a time...')
+total_count, count, failed_records = find_and_add_missing(client, INDEX_NAME, object_dict, summary, send_stats, journal, completed, existing_ids)
+summary.close()
+for entry in completed.values():
+    total_count += entry['missing']
+    count += entry['saved']
+    failed_records.extend(entry['failed'])
+journal.remove()
 
 print(f"Total number of objects not found in Algolia index: {total_count}")
 print(f"Total number of objects added to Algolia index: {count}")
-print(f"Total number of objects failed to add to Algolia index: {len(failed_records)}")
\ No newline at end of file
+print(f"Total number of objects failed to add to Algolia index: {len(failed_records)}")
+send_stats.report()
\ No newline at end of file
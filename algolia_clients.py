@@ -0,0 +1,239 @@
+## Shared factory of the Algolia clients used by send_event.py and add_missing_records.py, with call metrics.
+## Usage: python algolia_clients.py <metrics.json>
+##
+## The clients keep their connections alive in a pool of POOL_SIZE connections per host, with the timeouts
+## set here instead of the defaults of every script. Every API call (search, get_objects, save_objects,
+## Insights events, ...) is counted and timed in a latency histogram, including the retries of the client on
+## other hosts. A snapshot of the metrics is printed when the script exits, and on SIGUSR1 during long runs
+## (kill -USR1 <pid>). With ALGOLIA_METRICS_FILE set, the snapshot is also written to that file as JSON.
+## Run on its own, the script prints a snapshot written before.
+##
+## With ALGOLIA_STANDIN=host:port the clients are connected to the local stand-in of the API, see algolia_standin.py.
+##
+
+
+import os, sys, json, time, atexit, bisect, signal, threading
+
+from algoliasearch.configs import SearchConfig, InsightsConfig
+from algoliasearch.exceptions import RequestException, AlgoliaUnreachableHostException
+from algoliasearch.http.hosts import Host, HostsCollection
+from algoliasearch.http.requester import Requester
+from algoliasearch.http.transporter import Transporter
+from algoliasearch.insights_client import InsightsClient
+from algoliasearch.search_client import SearchClient
+from requests import Session
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+
+
+# Constants
+STANDIN_HOST = os.environ.get('ALGOLIA_STANDIN')  # host:port of a running stand-in, the clients use it instead of Algolia if set
+METRICS_FILE = os.environ.get('ALGOLIA_METRICS_FILE')  # JSON file the metrics snapshot is written to
+POOL_SIZE = 32  # Connections kept alive per host, more concurrent requests open connections that are closed afterwards
+POOL_HOSTS = 4  # Hosts connections are kept alive for, the DSN host and the 3 fallback hosts of an Algolia app
+CONNECT_TIMEOUT = 2  # Seconds, the defaults of the Algolia client
+READ_TIMEOUT = 5
+WRITE_TIMEOUT = 30
+STANDIN_SEARCH_HOSTS = 4  # Host entries of a search client of the stand-in, like the hosts of an Algolia app
+LATENCY_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000]  # Upper bounds of the histogram buckets
+
+# Name of the calls in the metrics, by the last part of the path of the request
+CALL_NAMES = {
+    'query': 'search',
+    'queries': 'multiple_queries',
+    'objects': 'get_objects',
+    'batch': 'save_objects',
+    'browse': 'browse',
+    'events': 'insights_events',
+    'indexes': 'list_indices',
+    'task': 'wait_task',
+}
+
+
+def call_name(path):
+    """Returns the name of a call in the metrics, e.g. 'search' for '1/indexes/products/query'."""
+    parts = path.split('?')[0].strip('/').split('/')
+    if len(parts) >= 2 and parts[-2] == 'task':
+        return CALL_NAMES['task']
+    return CALL_NAMES.get(parts[-1], parts[-1])
+
+
+class CallMetrics:
+    """
+    Counts, errors and latency histograms of the API calls of all clients, by call name. Shared by all threads,
+    the lock is reentrant so a snapshot taken in a signal handler doesn't wait for the interrupted thread.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.started = time.time()
+        self.calls = {}
+
+    def record(self, name, seconds, outcome='ok'):
+        """Records a call that took `seconds`, `outcome` is 'ok', the HTTP status of an error or 'unreachable'."""
+        ms = seconds * 1000
+        with self.lock:
+            call = self.calls.get(name)
+            if call is None:
+                call = self.calls[name] = {'count': 0, 'errors': {}, 'total_ms': 0.0, 'max_ms': 0.0,
+                                           'buckets': [0] * (len(LATENCY_BUCKETS_MS) + 1)}
+            call['count'] += 1
+            call['total_ms'] += ms
+            call['max_ms'] = max(call['max_ms'], ms)
+            call['buckets'][bisect.bisect_left(LATENCY_BUCKETS_MS, ms)] += 1
+            if outcome != 'ok':
+                call['errors'][outcome] = call['errors'].get(outcome, 0) + 1
+
+    def percentile(self, call, p):
+        """Returns the upper bound of the histogram bucket of the `p` percentile, the maximum for the last bucket."""
+        target = p / 100 * call['count']
+        seen = 0
+        for i, count in enumerate(call['buckets']):
+            seen += count
+            if seen >= target and count:
+                return LATENCY_BUCKETS_MS[i] if i < len(LATENCY_BUCKETS_MS) else call['max_ms']
+        return call['max_ms']
+
+    def snapshot(self):
+        """Returns the metrics as a dict that can be written as JSON."""
+        with self.lock:
+            calls = {}
+            for name, call in sorted(self.calls.items()):
+                calls[name] = {
+                    'count': call['count'],
+                    'errors': sum(call['errors'].values()),
+                    'errors_by_outcome': dict(call['errors']),
+                    'mean_ms': round(call['total_ms'] / call['count'], 2),
+                    'p50_ms': self.percentile(call, 50),
+                    'p95_ms': self.percentile(call, 95),
+                    'p99_ms': self.percentile(call, 99),
+                    'max_ms': round(call['max_ms'], 2),
+                    'histogram_ms': {f"<={bound}": count for bound, count in zip(LATENCY_BUCKETS_MS + ['inf'], call['buckets'])},
+                }
+        return {'created': time.strftime('%Y-%m-%d %H:%M:%S'), 'uptime_s': round(time.time() - self.started, 3), 'calls': calls}
+
+
+def print_snapshot(snapshot):
+    """Prints a metrics snapshot as a table, the percentiles are the upper bounds of their histogram buckets."""
+    print(f"Algolia calls in {snapshot['uptime_s']:.0f} seconds:")
+    for name, call in snapshot['calls'].items():
+        errors = ', '.join(f"{outcome}: {count}" for outcome, count in call['errors_by_outcome'].items())
+        print(f"  {name:<17} {call['count']:>8} calls {call['errors']:>6} errors   mean {call['mean_ms']:>8.1f} ms"
+              f"   p50 <={call['p50_ms']:>6} ms   p95 <={call['p95_ms']:>6} ms   p99 <={call['p99_ms']:>6} ms"
+              + (f"   ({errors})" if errors else ''))
+
+
+METRICS = CallMetrics()  # Metrics of all clients created by this module
+
+
+class PooledRequester(Requester):
+    """
+    Requester with a session keeping up to `pool_size` connections alive per host, shared by the threads of a client.
+    With `plain_http` the requests are sent over HTTP, as the client only builds https:// urls (used for the stand-in).
+    """
+
+    def __init__(self, pool_size=POOL_SIZE, plain_http=False):
+        super().__init__()
+        self.plain_http = plain_http
+        self._session = Session()
+        # the client retries on other hosts itself, urllib3 doesn't retry
+        adapter = HTTPAdapter(pool_connections=POOL_HOSTS, pool_maxsize=pool_size, max_retries=Retry(connect=0))
+        self._session.mount('https://', adapter)
+        self._session.mount('http://', adapter)
+
+    def send(self, request):
+        if self.plain_http and request.url.startswith('https://'):
+            request.url = 'http://' + request.url[len('https://'):]
+        return super().send(request)
+
+
+class MeasuredTransporter(Transporter):
+    """Transporter recording every call in `metrics`, from the first request to the response of the last host tried."""
+
+    def __init__(self, requester, config, metrics=METRICS):
+        super().__init__(requester, config)
+        self.metrics = metrics
+
+    def request(self, verb, hosts, path, data, request_options, timeout):
+        start = time.perf_counter()
+        outcome = 'ok'
+        try:
+            return super().request(verb, hosts, path, data, request_options, timeout)
+        except RequestException as e:
+            outcome = str(e.status_code)
+            raise
+        except AlgoliaUnreachableHostException:
+            outcome = 'unreachable'
+            raise
+        finally:
+            self.metrics.record(call_name(path), time.perf_counter() - start, outcome)
+
+
+def configure(config, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT, write_timeout=WRITE_TIMEOUT, standin_hosts=1):
+    config.connect_timeout = connect_timeout
+    config.read_timeout = read_timeout
+    config.write_timeout = write_timeout
+    if STANDIN_HOST:
+        # the client skips a host for Host.TTL seconds after a network error or 5xx, like the hosts of an Algolia app
+        config.hosts = HostsCollection([Host(STANDIN_HOST) for _ in range(standin_hosts)])
+    return config
+
+
+def create_search_client(app_id, api_key, batch_size=None, metrics=METRICS, pool_size=POOL_SIZE, **timeouts):
+    """
+    Returns a SearchClient with pooled connections and call metrics. `batch_size` is the number of records
+    per request of save_objects, `timeouts` can be connect_timeout, read_timeout and write_timeout in seconds.
+    """
+    config = configure(SearchConfig(app_id, api_key), standin_hosts=STANDIN_SEARCH_HOSTS, **timeouts)
+    if batch_size is not None:
+        config.batch_size = batch_size
+    requester = PooledRequester(pool_size, plain_http=bool(STANDIN_HOST))
+    return SearchClient(MeasuredTransporter(requester, config, metrics), config)
+
+
+def create_insights_client(app_id, api_key, metrics=METRICS, pool_size=POOL_SIZE, **timeouts):
+    """Returns an InsightsClient with pooled connections and call metrics, see create_search_client()."""
+    config = configure(InsightsConfig(app_id, api_key), **timeouts)
+    requester = PooledRequester(pool_size, plain_http=bool(STANDIN_HOST))
+    return InsightsClient(MeasuredTransporter(requester, config, metrics), config)
+
+
+def reset_hosts(client):
+    """
+    Marks all hosts of a client or index as up again. After a network error or a 5xx the client skips a host for
+    Host.TTL seconds (300), once all hosts are down every call fails at once without sending a request, so a
+    retry after a backoff has to reset them first.
+    """
+    hosts = client._config.hosts
+    for host in set(hosts.read() + hosts.write()):
+        host.reset()
+
+
+def export_metrics(metrics=METRICS, path=METRICS_FILE):
+    """Prints a snapshot of the metrics, and writes it to `path` if given."""
+    snapshot = metrics.snapshot()
+    if not snapshot['calls']:
+        return
+    print('')
+    print_snapshot(snapshot)
+    if path:
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(snapshot, f, indent=2)
+        os.replace(tmp_path, path)
+        print(f"Metrics written to {path}")
+
+
+def install_metrics_export(metrics=METRICS, path=METRICS_FILE):
+    """Exports the metrics when the script exits, and on SIGUSR1 where the platform has it."""
+    atexit.register(export_metrics, metrics, path)
+    if hasattr(signal, 'SIGUSR1') and threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGUSR1, lambda signum, frame: export_metrics(metrics, path))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python algolia_clients.py <metrics.json>")
+        sys.exit(1)
+    with open(sys.argv[1]) as f:
+        print_snapshot(json.load(f))
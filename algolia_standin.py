@@ -0,0 +1,426 @@
+## Local stand-in for the Algolia REST API, to run add_missing_records.py and send_event.py without an Algolia app.
+## Usage: python algolia_standin.py [--port 8181] [--index products] [--objects 10000] [--latency-ms 0] [--jitter-ms 0]
+##                                  [--rate-limit 0] [--max-record-bytes 10000] [--unreachable-rate 0] [--error-rate 0]
+##
+## Implements the endpoints used by the scripts: list indices, search, get_objects, browse, save_objects (batch),
+## task status and Insights events. Indices are kept in memory and seeded with synthetic objects.
+## Faults are injected before every request is answered:
+##   --latency-ms / --jitter-ms   delay of every response, the jitter is added at random
+##   --rate-limit                 requests per second over all connections, beyond that 429 'Too Many Requests'
+##   --max-record-bytes           records larger than this are rejected with 400 'Record ... is too big'
+##   --unreachable-rate           share of requests whose connection is closed without a response
+##   --error-rate                 share of requests answered with 503
+##
+## Point the scripts at a running stand-in with the ALGOLIA_STANDIN environment variable (read by algolia_clients.py),
+## any App ID and API key are accepted:
+##   ALGOLIA_STANDIN=127.0.0.1:8181 python add_missing_records.py
+##
+## GET /standin/stats returns the requests, faults, saved records and events counted so far.
+##
+
+
+import sys, json, time, uuid, random, threading, argparse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, unquote, parse_qsl
+
+
+# Constants
+DEFAULT_PORT = 8181
+DEFAULT_INDEX = 'products'
+DEFAULT_OBJECTS = 10000  # Number of synthetic objects the default index is seeded with
+MAX_RECORD_BYTES = 10000  # Maximum size of a record as serialized JSON, like the 10 KB limit of most Algolia plans
+MAX_EVENTS = 1000  # Maximum number of events per Insights request
+HITS_PER_PAGE = 20
+BROWSE_HITS_PER_PAGE = 1000
+NAME_WORDS = ['snickers', 'mars', 'twix', 'bounty', 'milky', 'way', 'chocolate', 'caramel', 'peanut', 'bar',
+              'cookie', 'crunchy', 'dark', 'white', 'mini', 'family', 'pack', 'classic', 'salted', 'almond']
+
+
+class Colors:
+    RED = '\033[91m'
+    GREEN = '\033[92m'
+    RESET = '\033[0m'
+
+
+class TokenBucket:
+    """
+    Allows `rate` requests per second with bursts of up to `burst` requests, shared by all request threads.
+
+    Args:
+    rate (float): Tokens added per second, 0 allows every request.
+    burst (int): Maximum number of tokens, defaults to one second of requests.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self):
+        """Returns True and takes a token if one is available."""
+        if not self.rate:
+            return True
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class StandInState:
+    """
+    Indices, fault settings and counters of a stand-in server, shared by all request threads.
+
+    Args:
+    latency_ms (float): Delay of every response in milliseconds.
+    jitter_ms (float): Maximum random delay added to `latency_ms`.
+    rate_limit (float): Requests per second before answering 429, 0 for no limit.
+    max_record_bytes (int): Records larger than this are rejected as too big.
+    unreachable_rate (float): Share of requests whose connection is closed without a response.
+    error_rate (float): Share of requests answered with 503.
+    """
+
+    def __init__(self, latency_ms=0, jitter_ms=0, rate_limit=0, max_record_bytes=MAX_RECORD_BYTES,
+                 unreachable_rate=0, error_rate=0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.bucket = TokenBucket(rate_limit)
+        self.max_record_bytes = max_record_bytes
+        self.unreachable_rate = unreachable_rate
+        self.error_rate = error_rate
+        self.lock = threading.Lock()
+        self.indices = {}
+        self.texts = {}  # Lowercase text of the string attributes of every object by index, searched by queries
+        self.query_cache = {}  # Hits by (index, query words), cleared by every write
+        self.task_id = 0
+        self.counters = {}
+        self.started = time.time()
+
+    def seed_index(self, name, count, seed=0):
+        """Adds `count` synthetic objects with the objectIDs '0' to 'count - 1' to an index."""
+        rng = random.Random(seed)
+        for i in range(count):
+            words = rng.sample(NAME_WORDS, 3)
+            self.put(name, {'objectID': str(i), 'name': ' '.join(words).title(), 'price': round(rng.uniform(0.5, 20), 2)})
+
+    def put(self, name, obj):
+        """Adds or replaces an object of an index, the caller holds the lock if the server is running."""
+        self.indices.setdefault(name, {})[obj['objectID']] = obj
+        self.query_cache.clear()
+        self.texts.setdefault(name, {})[obj['objectID']] = ' '.join(str(value) for value in obj.values() if isinstance(value, str)).lower()
+
+    def remove(self, name, object_id):
+        self.indices.get(name, {}).pop(object_id, None)
+        self.texts.get(name, {}).pop(object_id, None)
+        self.query_cache.clear()
+
+    def count(self, key, n=1):
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    def stats(self):
+        with self.lock:
+            counters = dict(self.counters)
+            indices = {name: len(objects) for name, objects in self.indices.items()}
+        return {'uptime_s': round(time.time() - self.started, 3), 'indices': indices, 'counters': counters}
+
+    def fault(self):
+        """Waits the configured latency and returns the fault to inject: 'unreachable', 'error', 'rate_limited' or None."""
+        delay = self.latency_ms + random.uniform(0, self.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000)
+        if self.unreachable_rate and random.random() < self.unreachable_rate:
+            return 'unreachable'
+        if self.error_rate and random.random() < self.error_rate:
+            return 'error'
+        if not self.bucket.take():
+            return 'rate_limited'
+        return None
+
+
+class ApiError(Exception):
+    """An error answered with `status` and an Algolia style {'message', 'status'} body."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def select_attributes(obj, attributes):
+    """Returns `obj` with only the `attributes` (a list, a JSON array or a comma separated string), objectID is always kept."""
+    if attributes is None:
+        return dict(obj)
+    if isinstance(attributes, str):
+        attributes = json.loads(attributes) if attributes.startswith('[') else [attribute.strip() for attribute in attributes.split(',')]
+    if '*' in attributes:
+        return dict(obj)
+    return {key: value for key, value in obj.items() if key == 'objectID' or key in attributes}
+
+
+def search_params(body):
+    """Returns the search parameters of a query, given as JSON keys or url-encoded in 'params' (multi-query style)."""
+    params = dict(parse_qsl(body.get('params', '')))
+    params.update({key: value for key, value in body.items() if key != 'params'})
+    return params
+
+
+def is_true(value):
+    return value is True or str(value).lower() == 'true'
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Answers the Algolia endpoints on keep-alive connections, the state is `self.server.state`."""
+
+    protocol_version = 'HTTP/1.1'
+    server_version = 'AlgoliaStandIn/1.0'
+    disable_nagle_algorithm = True  # The headers and body are written separately, don't wait for the ACK of the headers
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def do_PUT(self):
+        self.handle_request('PUT')
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def handle_request(self, method):
+        state = self.server.state
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length else b''
+        path = urlsplit(self.path).path
+        parts = [unquote(part) for part in path.strip('/').split('/')]
+
+        if path == '/standin/stats':
+            self.send_json(200, state.stats())
+            return
+
+        state.count('requests')
+        fault = state.fault()
+        if fault == 'unreachable':
+            state.count('faults.unreachable')
+            self.close_connection = True
+            return
+        if fault == 'error':
+            state.count('faults.error')
+            self.send_json(503, {'message': 'Service Unavailable', 'status': 503})
+            return
+        if fault == 'rate_limited':
+            state.count('faults.rate_limited')
+            self.send_json(429, {'message': 'Too Many Requests', 'status': 429})
+            return
+
+        try:
+            body = json.loads(raw) if raw else {}
+            status, response = self.route(state, method, parts, body)
+        except ApiError as e:
+            state.count(f"errors.{e.status}")
+            status, response = e.status, {'message': e.message, 'status': e.status}
+        except ValueError:
+            state.count('errors.400')
+            status, response = 400, {'message': 'Invalid JSON', 'status': 400}
+        self.send_json(status, response)
+
+    def route(self, state, method, parts, body):
+        """Returns (status, response) of a request, `parts` is the decoded path split at '/'."""
+        if parts[:1] == ['1'] and len(parts) >= 2 and parts[1] == 'indexes':
+            if method == 'GET' and len(parts) == 2:
+                return self.list_indices(state)
+            if method == 'POST' and parts[2:] == ['*', 'objects']:
+                return self.get_objects(state, body)
+            if method == 'POST' and parts[2:] == ['*', 'queries']:
+                return self.multiple_queries(state, body)
+            if method == 'POST' and len(parts) == 4 and parts[3] == 'query':
+                return self.search(state, parts[2], body)
+            if method == 'POST' and len(parts) == 4 and parts[3] == 'browse':
+                return self.browse(state, parts[2], body)
+            if method == 'POST' and len(parts) == 4 and parts[3] == 'batch':
+                return self.batch(state, parts[2], body)
+            if method == 'GET' and len(parts) == 5 and parts[3] == 'task':
+                state.count('calls.task')
+                return 200, {'status': 'published', 'pendingTask': False}
+        if method == 'POST' and parts == ['1', 'events']:
+            return self.events(state, body)
+        raise ApiError(404, 'Not Found')
+
+    def list_indices(self, state):
+        state.count('calls.list_indices')
+        with state.lock:
+            items = [{'name': name, 'entries': len(objects)} for name, objects in state.indices.items()]
+        return 200, {'items': items, 'nbPages': 1}
+
+    def get_objects(self, state, body):
+        state.count('calls.get_objects')
+        results = []
+        with state.lock:
+            for request in body.get('requests', []):
+                obj = state.indices.get(request.get('indexName'), {}).get(str(request.get('objectID')))
+                results.append(select_attributes(obj, request.get('attributesToRetrieve')) if obj is not None else None)
+        state.count('objects.retrieved', sum(result is not None for result in results))
+        return 200, {'results': results}
+
+    def query(self, state, index_name, params):
+        """Returns the response of one query: objects containing every word of the query, in the order they were added."""
+        with state.lock:
+            if index_name not in state.indices:
+                raise ApiError(404, 'Index does not exist')
+            objects = state.indices[index_name]
+            texts = state.texts.get(index_name, {})
+            words = str(params.get('query', '')).lower().split()
+            hits = state.query_cache.get((index_name, tuple(words)))
+            if hits is None:
+                hits = [objects[object_id] for object_id, text in texts.items() if all(word in text for word in words)]
+                state.query_cache[(index_name, tuple(words))] = hits
+        hits_per_page = int(params.get('hitsPerPage', HITS_PER_PAGE))
+        page = int(params.get('page', 0))
+        response = {
+            'hits': [select_attributes(obj, params.get('attributesToRetrieve')) for obj in hits[page * hits_per_page:(page + 1) * hits_per_page]],
+            'nbHits': len(hits),
+            'page': page,
+            'nbPages': -(-len(hits) // hits_per_page),
+            'hitsPerPage': hits_per_page,
+            'query': params.get('query', ''),
+            'index': index_name,
+        }
+        if is_true(params.get('clickAnalytics')):
+            response['queryID'] = uuid.uuid4().hex
+        return response
+
+    def search(self, state, index_name, body):
+        state.count('calls.search')
+        return 200, self.query(state, index_name, search_params(body))
+
+    def multiple_queries(self, state, body):
+        state.count('calls.multiple_queries')
+        requests = body.get('requests', [])
+        state.count('queries', len(requests))
+        return 200, {'results': [self.query(state, request.get('indexName'), search_params(request)) for request in requests]}
+
+    def browse(self, state, index_name, body):
+        state.count('calls.browse')
+        params = search_params(body)
+        with state.lock:
+            if index_name not in state.indices:
+                raise ApiError(404, 'Index does not exist')
+            objects = list(state.indices[index_name].values())
+        start = int(params.get('cursor') or 0)
+        hits_per_page = int(params.get('hitsPerPage', BROWSE_HITS_PER_PAGE))
+        response = {
+            'hits': [select_attributes(obj, params.get('attributesToRetrieve')) for obj in objects[start:start + hits_per_page]],
+            'nbHits': len(objects),
+        }
+        if start + hits_per_page < len(objects):
+            response['cursor'] = str(start + hits_per_page)
+        return 200, response
+
+    def batch(self, state, index_name, body):
+        """Applies a batch of write operations, a batch with a record that is too big is rejected as a whole."""
+        state.count('calls.batch')
+        requests = body.get('requests', [])
+        for position, request in enumerate(requests):
+            record = request.get('body', {})
+            size = len(json.dumps(record).encode('utf-8'))
+            if request.get('action') != 'deleteObject' and size > state.max_record_bytes:
+                state.count('records.too_big')
+                raise ApiError(400, f"Record at the position {position} objectID={record.get('objectID')} is too big "
+                                    f"size={size}/{state.max_record_bytes} bytes. Please have a look at "
+                                    f"https://www.algolia.com/doc/guides/sending-and-managing-data/prepare-your-data/in-depth/index-and-records-size-and-usage-limitations/#record-size-limits")
+        object_ids = []
+        with state.lock:
+            objects = state.indices.setdefault(index_name, {})
+            for request in requests:
+                action = request.get('action')
+                record = dict(request.get('body', {}))
+                object_id = str(record.get('objectID') or uuid.uuid4().hex)
+                record['objectID'] = object_id
+                if action in ('addObject', 'updateObject'):
+                    state.put(index_name, record)
+                elif action in ('partialUpdateObject', 'partialUpdateObjectNoCreate'):
+                    if object_id in objects or action == 'partialUpdateObject':
+                        state.put(index_name, dict(objects.get(object_id, {}), **record))
+                elif action == 'deleteObject':
+                    state.remove(index_name, object_id)
+                else:
+                    raise ApiError(400, f"Invalid action {action}")
+                object_ids.append(object_id)
+            state.task_id += 1
+            task_id = state.task_id
+        state.count('records.saved', len(requests))
+        return 200, {'taskID': task_id, 'objectIDs': object_ids}
+
+    def events(self, state, body):
+        state.count('calls.events')
+        events = body.get('events', [])
+        if not events or len(events) > MAX_EVENTS:
+            raise ApiError(422, f"Expected between 1 and {MAX_EVENTS} events, got {len(events)}")
+        for position, event in enumerate(events):
+            missing = [key for key in ('eventType', 'eventName', 'index', 'userToken') if not event.get(key)]
+            if missing:
+                raise ApiError(422, f"Event at the position {position} is missing {', '.join(missing)}")
+            if event.get('queryID') and not event.get('objectIDs'):
+                raise ApiError(422, f"Event at the position {position} has a queryID but no objectIDs")
+        for event in events:
+            state.count(f"events.{event['eventType']}")
+        state.count('events', len(events))
+        return 200, {'status': 200, 'message': 'OK'}
+
+
+def start_server(state, host='127.0.0.1', port=DEFAULT_PORT):
+    """Starts a stand-in server in a background thread and returns it, `server.server_address` has the port if `port` is 0."""
+    server = ThreadingHTTPServer((host, port), StandInHandler)
+    server.daemon_threads = True
+    server.state = state
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Local stand-in for the Algolia search, indexing and Insights API.")
+    parser.add_argument('--host', default='127.0.0.1', help="address to listen on (default: 127.0.0.1)")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help=f"port to listen on (default: {DEFAULT_PORT})")
+    parser.add_argument('--index', default=DEFAULT_INDEX, help=f"name of the seeded index (default: {DEFAULT_INDEX})")
+    parser.add_argument('--objects', type=int, default=DEFAULT_OBJECTS, help=f"objects in the seeded index (default: {DEFAULT_OBJECTS})")
+    parser.add_argument('--latency-ms', type=float, default=0, help="delay of every response in milliseconds")
+    parser.add_argument('--jitter-ms', type=float, default=0, help="maximum random delay added to the latency")
+    parser.add_argument('--rate-limit', type=float, default=0, help="requests per second before answering 429 (default: no limit)")
+    parser.add_argument('--max-record-bytes', type=int, default=MAX_RECORD_BYTES, help=f"records larger than this are rejected (default: {MAX_RECORD_BYTES})")
+    parser.add_argument('--unreachable-rate', type=float, default=0, help="share of requests closed without a response, e.g. 0.01")
+    parser.add_argument('--error-rate', type=float, default=0, help="share of requests answered with 503, e.g. 0.01")
+    args = parser.parse_args(argv)
+
+    state = StandInState(args.latency_ms, args.jitter_ms, args.rate_limit, args.max_record_bytes,
+                         args.unreachable_rate, args.error_rate)
+    state.seed_index(args.index, args.objects)
+    server = start_server(state, args.host, args.port)
+    address = f"{server.server_address[0]}:{server.server_address[1]}"
+    print(f"{Colors.GREEN}Algolia stand-in listening on {address}{Colors.RESET}, index '{args.index}' with {args.objects} objects")
+    print(f"Run the scripts with ALGOLIA_STANDIN={address}, stop with Ctrl+C")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
+        print('')
+        print(json.dumps(state.stats(), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
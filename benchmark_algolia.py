@@ -0,0 +1,226 @@
+## This script benchmarks add_missing_records.py and send_event.py against the local Algolia stand-in (algolia_standin.py).
+## Usage: python benchmark_algolia.py [--records 100000] [--existing 50000] [--events 2000] [--latency-ms 0] [--rate-limit 0]
+##                                    [--unreachable-rate 0] [--error-rate 0] [--max-record-bytes 10000] [--browse]
+##                                    [--events-per-second 0] [--queries-per-request 50] [--load] [--concurrency 8]
+##
+## A stand-in is started for every run with an index of `--existing` objects. add_missing_records.py is run on an
+## input file of `--records` records (the first `--existing` of them are already in the index) with its prompts
+## answered on stdin, giving the records checked and saved per second. send_event.send_events() is then called
+## until `--events` events are sent, giving the events per second, or with `--events-per-second` the events are sent
+## in batches by send_event.send_batched_events() at that rate, with queryIDs of `--queries-per-request` searches per request.
+## `--load` runs the load test of send_event.run_load() at that rate instead, with the latency percentiles of the calls.
+## Results are written to benchmarks/results/algolia-<timestamp>.json.
+##
+
+
+import os, io, sys, json, time, socket, argparse, subprocess
+from contextlib import contextmanager, redirect_stdout
+from urllib.request import urlopen
+
+import algolia_clients
+import algolia_standin
+import send_event
+
+
+# Constants
+BENCHMARK_DIR = 'benchmarks'
+DEFAULT_RECORDS = 100000
+DEFAULT_EXISTING = 50000
+DEFAULT_EVENTS = 2000
+INDEX_NAME = 'benchmark'
+USER_TOKEN = 'benchmark'
+QUERY = 'snickers'
+STARTUP_TIMEOUT = 30  # Seconds to wait for the stand-in to accept connections
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def get_stats(address):
+    with urlopen(f"http://{address}/standin/stats") as response:
+        return json.load(response)
+
+
+@contextmanager
+def standin(args, objects):
+    """Runs a stand-in with the fault settings of `args` and an index of `objects` objects, yields its address."""
+    address = f"127.0.0.1:{free_port()}"
+    command = [sys.executable, 'algolia_standin.py', '--port', address.split(':')[1], '--index', INDEX_NAME,
+               '--objects', str(objects), '--latency-ms', str(args.latency_ms), '--jitter-ms', str(args.jitter_ms),
+               '--rate-limit', str(args.rate_limit), '--unreachable-rate', str(args.unreachable_rate),
+               '--error-rate', str(args.error_rate), '--max-record-bytes', str(args.max_record_bytes)]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    try:
+        deadline = time.time() + STARTUP_TIMEOUT
+        while True:
+            try:
+                get_stats(address)
+                break
+            except OSError:
+                if time.time() > deadline or process.poll() is not None:
+                    raise RuntimeError(f"the stand-in didn't start on {address}")
+                time.sleep(0.1)
+        yield address
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def write_input_file(path, records):
+    """Writes an input file for add_missing_records.py with the objectIDs '0' to 'records - 1'."""
+    if os.path.exists(path):
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write('name,object_id\n')
+        for i in range(records):
+            f.write(f"Product {i},{i}\n")
+
+
+def benchmark_records(args, data_dir):
+    """Runs add_missing_records.py against a stand-in and returns its result."""
+    input_file = os.path.join(data_dir, f"algolia_records_{args.records}.csv")
+    output_file = os.path.join(data_dir, 'algolia_summary.ndjson')
+    metrics_file = os.path.join(data_dir, 'algolia_metrics.json')
+    write_input_file(input_file, args.records)
+    for path in (output_file, f"{output_file}.journal", metrics_file):
+        if os.path.exists(path):
+            os.remove(path)
+
+    answers = '\n'.join([input_file, output_file, 'benchmark', 'benchmark', INDEX_NAME, '', 'yes' if args.browse else 'no']) + '\n'
+    mode = 'browse' if args.browse else 'lookup'
+    print(f"add_missing_records.py, {args.records} records, {args.existing} in the index ({mode})...")
+    with standin(args, args.existing) as address:
+        env = dict(os.environ, ALGOLIA_STANDIN=address, ALGOLIA_METRICS_FILE=metrics_file)
+        start = time.perf_counter()
+        process = subprocess.run([sys.executable, 'add_missing_records.py'], input=answers, env=env,
+                                 capture_output=True, text=True)
+        seconds = time.perf_counter() - start
+        stats = get_stats(address)
+    if process.returncode != 0:
+        print(process.stdout[-2000:])
+        print(process.stderr[-2000:])
+        raise RuntimeError(f"add_missing_records.py exited with {process.returncode}")
+
+    with open(metrics_file) as f:
+        calls = json.load(f)['calls']
+
+    counters = stats['counters']
+    saved = counters.get('records.saved', 0)
+    result = {
+        'benchmark': 'add_missing_records', 'mode': mode, 'records': args.records, 'existing': args.existing,
+        'wall_s': round(seconds, 3), 'records_per_s': round(args.records / seconds, 1),
+        'saved': saved, 'saved_per_s': round(saved / seconds, 1), 'counters': counters, 'calls': calls,
+    }
+    print(f"  {result['wall_s']:>9.2f}s {result['records_per_s']:>12.1f} records/s checked {result['saved_per_s']:>12.1f} records/s saved")
+    print_calls(calls)
+    return result
+
+
+def print_calls(calls):
+    for name, call in calls.items():
+        print(f"  {name:<17} {call['count']:>8} calls {call['errors']:>6} errors   p50 <={call['p50_ms']:>6} ms   p99 <={call['p99_ms']:>6} ms")
+
+
+def benchmark_events(args):
+    """Sends events with send_event.send_events() against a stand-in and returns the result."""
+    mode = 'one request per event'
+    if args.load:
+        mode = f"load test at {args.events_per_second:g} events/s, {args.concurrency} concurrent requests"
+    elif args.events_per_second:
+        mode = f"batched at {args.events_per_second:g} events/s, {args.queries_per_request} searches per request"
+    print(f"send_event.py, {args.events} events, {mode}...")
+    with standin(args, args.existing) as address:
+        algolia_clients.STANDIN_HOST = address
+        metrics = algolia_clients.CallMetrics()
+        client = algolia_clients.create_search_client('benchmark', 'benchmark', metrics=metrics)
+        insights_client = algolia_clients.create_insights_client('benchmark', 'benchmark', metrics=metrics)
+        index = client.init_index(INDEX_NAME)
+        errors = 0
+        load = None
+        start = time.perf_counter()
+        if args.load:
+            with redirect_stdout(io.StringIO()):
+                load = send_event.run_load(index, insights_client, INDEX_NAME, USER_TOKEN, QUERY, args.events_per_second,
+                                           args.concurrency, None, args.events)
+            errors = load['search']['errors'] + load['insights']['errors']
+        elif args.events_per_second:
+            pool = send_event.QueryIdPool(client, INDEX_NAME, QUERY, USER_TOKEN, args.queries_per_request)
+            with redirect_stdout(io.StringIO()):
+                batcher = send_event.send_batched_events(pool, insights_client, INDEX_NAME, args.events_per_second, args.events)
+            errors = batcher.failed
+        for i in range(0, args.events if not args.events_per_second else 0, 2):
+            try:
+                results = send_event.search(index, USER_TOKEN, QUERY)
+                hit = results['hits'][i % len(results['hits'])]
+                with redirect_stdout(io.StringIO()):
+                    send_event.send_events(insights_client, f"{USER_TOKEN}-{i}", INDEX_NAME, [hit['objectID']],
+                                           i % len(results['hits']) + 1, results['queryID'])
+            except Exception as e:
+                errors += 1
+                if errors == 1:
+                    print(f"  first error: {e}")
+        seconds = time.perf_counter() - start
+        stats = get_stats(address)
+
+    counters = stats['counters']
+    events = counters.get('events', 0)
+    result = {
+        'benchmark': 'send_event', 'mode': mode, 'events': events, 'errors': errors, 'wall_s': round(seconds, 3),
+        'events_per_s': round(events / seconds, 1), 'counters': counters, 'calls': metrics.snapshot()['calls'],
+    }
+    print(f"  {result['wall_s']:>9.2f}s {result['events_per_s']:>12.1f} events/s, {errors} errors")
+    print_calls(result['calls'])
+    if load is not None:
+        result['load'] = load
+        for call in ('search', 'insights'):
+            print(f"  {call:<9} p50 {load[call]['p50_ms']:>8.1f} ms   p95 {load[call]['p95_ms']:>8.1f} ms   p99 {load[call]['p99_ms']:>8.1f} ms")
+    return result
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Benchmark add_missing_records.py and send_event.py against the local Algolia stand-in.")
+    parser.add_argument('--records', type=int, default=DEFAULT_RECORDS, help=f"records in the input file (default: {DEFAULT_RECORDS})")
+    parser.add_argument('--existing', type=int, default=DEFAULT_EXISTING, help=f"of them already in the index (default: {DEFAULT_EXISTING})")
+    parser.add_argument('--events', type=int, default=DEFAULT_EVENTS, help=f"events to send, 0 to skip (default: {DEFAULT_EVENTS})")
+    parser.add_argument('--events-per-second', type=float, default=0, help="send the events in batches at this rate (default: one request per event)")
+    parser.add_argument('--queries-per-request', type=int, default=send_event.QUERIES_PER_REQUEST, help=f"searches per multi-query request in batched mode (default: {send_event.QUERIES_PER_REQUEST})")
+    parser.add_argument('--load', action='store_true', help="run the load test of send_event.py at --events-per-second instead of the batched mode")
+    parser.add_argument('--concurrency', type=int, default=send_event.LOAD_CONCURRENCY, help=f"concurrent requests of the load test (default: {send_event.LOAD_CONCURRENCY})")
+    parser.add_argument('--browse', action='store_true', help="browse the index instead of looking up the objectIDs")
+    parser.add_argument('--latency-ms', type=float, default=0, help="delay of every response of the stand-in")
+    parser.add_argument('--jitter-ms', type=float, default=0, help="maximum random delay added to the latency")
+    parser.add_argument('--rate-limit', type=float, default=0, help="requests per second of the stand-in before answering 429")
+    parser.add_argument('--unreachable-rate', type=float, default=0, help="share of requests closed without a response")
+    parser.add_argument('--error-rate', type=float, default=0, help="share of requests answered with 503")
+    parser.add_argument('--max-record-bytes', type=int, default=algolia_standin.MAX_RECORD_BYTES, help="records larger than this are rejected by the stand-in")
+    parser.add_argument('--dir', default=BENCHMARK_DIR, help=f"directory for generated data and results (default: {BENCHMARK_DIR})")
+    args = parser.parse_args(argv)
+    if args.load and not args.events_per_second:
+        parser.error("--load needs --events-per-second")
+
+    data_dir = os.path.join(args.dir, 'data')
+    results_dir = os.path.join(args.dir, 'results')
+    os.makedirs(results_dir, exist_ok=True)
+
+    results = []
+    if args.records:
+        results.append(benchmark_records(args, data_dir))
+    if args.events:
+        results.append(benchmark_events(args))
+
+    settings = {key: value for key, value in vars(args).items() if key != 'dir'}
+    run = {'created': time.strftime('%Y-%m-%d %H:%M:%S'), 'python': sys.version.split()[0], 'settings': settings, 'results': results}
+    results_file = os.path.join(results_dir, f"algolia-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(results_file, 'w') as f:
+        json.dump(run, f, indent=2)
+    print('')
+    print(f"Results written to {results_file}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,192 @@
+## This script benchmarks the stages of create_report.py on synthetic radar exports.
+## Usage: python benchmark_report.py [--rows 10000,100000] [--baseline benchmarks/baseline.json] [--save-baseline]
+##
+## For every scale the exports are generated once with generate_radar_exports.py (and kept in benchmarks/data),
+## then the report is run like create_report.py runs it, streaming the exports in chunks into the workbook. The whole
+## run is timed and memory-profiled, and so are its stages: reading the chunks, computing the uplift and rerank rows,
+## writing the workbook and selecting the rerank candidates.
+## Results are written to benchmarks/results/<timestamp>.json. If a baseline exists, every stage is compared
+## against it and the script exits with 1 if a stage got slower than the allowed tolerance.
+##
+
+
+import os, io, sys, json, time, argparse, tracemalloc
+from contextlib import contextmanager, redirect_stdout
+import pandas as pd
+
+import create_report
+import generate_radar_exports
+
+
+# Constants
+BENCHMARK_DIR = 'benchmarks'
+DEFAULT_ROWS = '10000,100000'
+TOLERANCE = 0.2  # Allowed slowdown of a stage compared to the baseline
+MIN_SECONDS = 0.25  # Stages faster than this are not compared, their timings are mostly noise
+
+DAYS = 14
+LCB_TRESHOLD = 0.3
+MIN_DOLLAR_AMOUNT = 5000
+
+
+@contextmanager
+def stage(results, rows, name, trace_memory=True):
+    """
+    Times a stage and records its wall time, CPU time, peak traced memory and the peak RSS of the process.
+    Tracing memory allocations slows down stages creating many Python objects (mostly 'write'), the peak
+    traced memory is left out with `trace_memory` False.
+    """
+    result = {'rows': rows, 'stage': name}
+    if trace_memory:
+        tracemalloc.start()
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        yield result
+    finally:
+        result['wall_s'] = round(time.perf_counter() - wall_start, 4)
+        result['cpu_s'] = round(time.process_time() - cpu_start, 4)
+        result['peak_traced_mb'] = None
+        if trace_memory:
+            result['peak_traced_mb'] = round(tracemalloc.get_traced_memory()[1] / 1024 / 1024, 1)
+            tracemalloc.stop()
+        max_rss = create_report.max_rss_mb()
+        result['max_rss_mb'] = round(max_rss, 1) if max_rss is not None else None
+        results.append(result)
+        traced = f"{result['peak_traced_mb']:>9.1f} MB traced" if trace_memory else ''
+        max_rss = f"{result['max_rss_mb']:>9.1f} MB max RSS" if result['max_rss_mb'] is not None else ''
+        print(f"  {name:<12} {result['wall_s']:>9.2f}s wall {result['cpu_s']:>9.2f}s cpu {traced} {max_rss}")
+
+
+def benchmark(rows, data_dir, check=False, trace_memory=True):
+    """
+    Runs the report on exports with `rows` rows of 'query_reranking' like create_report.py does, streaming every
+    export in chunks into the workbook, and returns the results of its stages. 'report' is the whole run with
+    its peak traced memory, the other stages are the steps measured by a ReportProfiler added up over all sheets:
+    'read' (parsing the chunks), 'compute' (uplift and rerank rows), 'write' and 'candidates'.
+    """
+    directory = os.path.join(data_dir, f"rows_{rows}")
+    if not os.path.isdir(directory):
+        print(f"generating exports with {rows} rows...")
+        generate_radar_exports.generate_exports(directory, rows)
+    csv_files = create_report.get_export_files(directory)
+
+    print(f"{rows} rows:")
+    results = []
+    profiler = create_report.ReportProfiler()
+    output_filename = os.path.join(data_dir, f"rows_{rows}.xlsx")
+    with stage(results, rows, 'report', trace_memory) as result:
+        with redirect_stdout(io.StringIO()):
+            model = create_report.compute_report(csv_files, DAYS, LCB_TRESHOLD, MIN_DOLLAR_AMOUNT,
+                                                 writers=[create_report.ReportWriter(output_filename)], profiler=profiler)
+        result['output_rows'] = sum(model.sheet_rows.values())
+    results.extend(profiler_stages(rows, profiler))
+
+    if check:
+        check_candidates(candidate_rows(csv_files, model))
+    return results
+
+
+def profiler_stages(rows, profiler):
+    """Returns the steps of a ReportProfiler added up per stage over all sheets, and prints them."""
+    stages = {}
+    for record in profiler.summary():
+        result = stages.setdefault(record['stage'], {'rows': rows, 'stage': record['stage'], 'wall_s': 0, 'cpu_s': 0,
+                                                     'peak_traced_mb': None, 'max_rss_mb': None, 'output_rows': 0})
+        result['wall_s'] += record['wall_s']
+        result['cpu_s'] += record['cpu_s']
+        result['output_rows'] += record['rows']
+        if record['max_rss_mb'] is not None:
+            result['max_rss_mb'] = round(max(result['max_rss_mb'] or 0, record['max_rss_mb']), 1)
+    for result in stages.values():
+        result['wall_s'] = round(result['wall_s'], 4)
+        result['cpu_s'] = round(result['cpu_s'], 4)
+        max_rss = f"{result['max_rss_mb']:>9.1f} MB max RSS" if result['max_rss_mb'] is not None else ''
+        print(f"  {result['stage']:<12} {result['wall_s']:>9.2f}s wall {result['cpu_s']:>9.2f}s cpu {max_rss}")
+    return list(stages.values())
+
+
+def candidate_rows(csv_files, model):
+    """Returns the 'query_reranking' rows of the candidate queries of a computed report, with their uplift."""
+    candidates, query_uplift, _ = create_report.summarize_insights(model.insights, MIN_DOLLAR_AMOUNT)
+    csv_file = next(f for f in csv_files if create_report.get_sheet_name(f) == 'query_reranking')
+    rerank_df = pd.concat(chunk[chunk['query_fingerprint'].isin(candidates)]
+                          for chunk in create_report.iter_csv_chunks(csv_file, 'query_reranking'))
+    rerank_df['annualized_uplift'] = rerank_df['query_fingerprint'].map(query_uplift)
+    return rerank_df
+
+
+def check_candidates(rerank_df):
+    """Checks that select_rerank_candidates gives the same result as applying process_group to every fingerprint."""
+    result_groups = rerank_df.groupby('query_fingerprint').filter(lambda x: (x['lcb'] > LCB_TRESHOLD).sum() >= create_report.MIN_ABOVE_THRESHOLD)
+    groups = [create_report.process_group(group, LCB_TRESHOLD) for _, group in result_groups.groupby('query_fingerprint')]
+    expected = pd.concat(groups) if groups else pd.DataFrame()
+    actual = create_report.select_rerank_candidates(rerank_df, LCB_TRESHOLD)
+    if expected.empty and actual.empty:
+        print("  candidates match the process_group implementation (none found)")
+        return
+    pd.testing.assert_frame_equal(expected, actual)
+    print(f"  candidates match the process_group implementation ({len(actual)} rows)")
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """Prints every stage compared to the baseline, returns the stages that got slower than `tolerance`."""
+    baseline_stages = {(r['rows'], r['stage']): r for r in baseline['results']}
+    regressions = []
+    print('')
+    print(f"compared to baseline from {baseline['created']}:")
+    for result in results:
+        base = baseline_stages.get((result['rows'], result['stage']))
+        if base is None:
+            continue
+        ratio = result['wall_s'] / base['wall_s'] if base['wall_s'] else 1
+        regressed = ratio > 1 + tolerance and result['wall_s'] >= MIN_SECONDS
+        if regressed:
+            regressions.append(result)
+        status = f"{create_report.Colors.RED}slower{create_report.Colors.RESET}" if regressed else 'ok'
+        print(f"  {result['rows']:>10} {result['stage']:<12} {base['wall_s']:>9.2f}s -> {result['wall_s']:>9.2f}s ({ratio:.2f}x) {status}")
+    return regressions
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Benchmark the stages of create_report.py on synthetic exports.")
+    parser.add_argument('--rows', default=DEFAULT_ROWS, help=f"comma separated scales, rows of query_reranking (default: {DEFAULT_ROWS})")
+    parser.add_argument('--dir', default=BENCHMARK_DIR, help=f"directory for generated data and results (default: {BENCHMARK_DIR})")
+    parser.add_argument('--baseline', default=None, help="baseline results to compare against (default: <dir>/baseline.json)")
+    parser.add_argument('--save-baseline', action='store_true', help="save the results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE, help=f"allowed slowdown per stage (default: {TOLERANCE})")
+    parser.add_argument('--check', action='store_true', help="also check the candidates against the process_group implementation")
+    parser.add_argument('--no-tracemalloc', action='store_true', help="don't trace memory allocations, only record the peak RSS")
+    args = parser.parse_args(argv)
+
+    data_dir = os.path.join(args.dir, 'data')
+    results_dir = os.path.join(args.dir, 'results')
+    baseline_file = args.baseline or os.path.join(args.dir, 'baseline.json')
+    os.makedirs(results_dir, exist_ok=True)
+
+    results = []
+    for rows in create_report.parse_values(args.rows, int):
+        results.extend(benchmark(rows, data_dir, args.check, not args.no_tracemalloc))
+
+    run = {'created': time.strftime('%Y-%m-%d %H:%M:%S'), 'python': sys.version.split()[0], 'pandas': pd.__version__, 'results': results}
+    results_file = os.path.join(results_dir, f"{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(results_file, 'w') as f:
+        json.dump(run, f, indent=2)
+    print('')
+    print(f"Results written to {results_file}")
+
+    if args.save_baseline:
+        with open(baseline_file, 'w') as f:
+            json.dump(run, f, indent=2)
+        print(f"Saved as baseline {baseline_file}")
+    elif os.path.exists(baseline_file):
+        with open(baseline_file) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"{create_report.Colors.RED}{len(regressions)} stage(s) got slower than the baseline{create_report.Colors.RESET}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -1,8 +1,14 @@
 
 ## This script is used to create an excel report from exported CSV files from VE admin panel.
 ## Usage: python create_report.py <relative_path>
+##        python create_report.py --batch <config.json or directories> [--workers N]
+##        python create_report.py --watch <root_directory> [--workers N] [--settle 10]
+##        add --profile to print the time spent per stage and file, --trace to write it to <name>_trace.json
+##        add --incremental to only read the files that changed since the last run, see ReportState
 ##
 ## The script will ask for the sub directory containing the exported CSV files and parameters to use.
+## In batch mode it builds the reports of all given directories without asking, see run_batch().
+## In watch mode it keeps running and rebuilds the report of every export directory that changes, see watch().
 ##
 ## Author: Andreas De Stefani, Algolia Solutions Engineering
 ## Date: 2024-05
@@ -18,21 +24,72 @@ DATE_W = 20
 QUERY_W = 30
 FILTER_W = 30
 
-STANDARD_BG_COLOR = '#FFFFFF'  # Default background color for headers
+HEADER_BG_COLOR = '#D7E4BC'  # Background color of headers not listed in header_info
 STANDARD_COL_WIDTH = 15  # Default column width
 
+CHUNK_ROWS = 50000  # Number of rows read from an export and written to its sheet at a time
+PARSE_VERSION = 2  # Part of the export cache keys, increase when changing how exports are parsed
+MIN_ABOVE_THRESHOLD = 3  # Number of results above the LCB threshold a query needs to be a rerank candidate
+UPLIFT_COL = 'annualized uplift after multiplier'
+REPORT_FORMATS = ('xlsx', 'csv', 'parquet', 'json')
+WATCH_INTERVAL = 2  # Seconds between two scans of the watched directory
+WATCH_SETTLE = 10  # Seconds the files of a directory must stay unchanged before its report is rebuilt
+REPORT_DIR_SUFFIXES = ('_csv', '_parquet', '_state')  # Directories written next to a report, not watched
+
+# Columns of 'query_insights' kept in memory for the uplift and rerank candidate calculations, the revenue increase
+# is kept so the uplift of a previous run can be annualized again for another number of days
+INSIGHTS_COLUMNS = ['query_fingerprint', 'conversion_rate', 'ctr', 'is_category_page', 'revenue_increase_after_multiplier', UPLIFT_COL]
+AGGREGATED_SHEETS = ('query_insights', 'query_reranking')  # Sheets whose aggregates are kept between incremental runs
+
+# Columns each export needs to have and the types they are read as, other columns keep the types pandas infers.
+# Metrics compared against thresholds or summed into the uplift stay float64, as float32 would change results
+# (e.g. an lcb of exactly 0.3 being above a threshold of 0.3).
+EXPORT_SCHEMAS = {
+    'query_insights': {
+        'query_fingerprint': 'uint64',
+        'is_category_page': 'boolean',  # nullable, the flag can be blank
+        'ctr': 'float64',
+        'conversion_rate': 'float64',
+        'revenue_increase_after_multiplier': 'float64',
+    },
+    'query_reranking': {
+        'query_fingerprint': 'uint64',
+        'lcb': 'float64',
+    },
+    'all_queries_top50KByRank': {
+        'query_fingerprint': 'uint64',
+    },
+    'position_bias': {},
+}
+
 # Dictionary mapping headers to background colors
 header_info = {
-    'ID': {'color:':"#CC0000", 'width':20},  # Red
+    'ID': {'color':"#CC0000", 'width':20},  # Red
     'ctr': {'color':'#00FF00', 'width':10}  # Green
 }
 
 
 
-import os, sys
+import os, sys, json, time, pickle, signal, argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+import numpy as np
 import pandas as pd
 import xlsxwriter
 
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+import export_cache
+
 # ANSI escape codes
 class Colors:
     RED = '\033[91m'
@@ -61,6 +118,25 @@ def get_subdirectories(directory):
 
 
 
+def summarize_insights(df, min_dollar_amount=5000):
+    """
+    Returns the fingerprints of the queries that can be rerank candidates (conversion rate below CTR and an annualized
+    uplift above `min_dollar_amount`), the annualized uplift of every query and the uplift totals of 'query_insights'.
+    """
+    # Get values from column 'C' where 'Q' < 'P' and 'AG' >= 10000
+    rerank_candidates_list = set(df.loc[(df['conversion_rate'] < df['ctr']) & (df[UPLIFT_COL] > min_dollar_amount), 'query_fingerprint'])
+    query_uplift = df.set_index('query_fingerprint')[UPLIFT_COL].to_dict()
+    total_rev_uplift = df[UPLIFT_COL].sum()
+    # a blank flag isn't counted as a search, like the original comparison with False
+    total_search_uplift = df.loc[~df['is_category_page'].fillna(True), UPLIFT_COL].sum()
+    totals = {
+        'total_rev_uplift': total_rev_uplift,
+        'total_search_uplift': total_search_uplift,
+        'total_browsed_uplift': total_rev_uplift - total_search_uplift,
+    }
+    return rerank_candidates_list, query_uplift, totals
+
+
 def process_group(group, lcb_treshold=0.35):
     max_h_idx = group['lcb'].idxmax()  # Get the index of the max 'H' value
     max_h_row = group.loc[[max_h_idx]].copy()  # Use loc to get the row and ensure it's a copy
@@ -69,176 +145,1126 @@ def process_group(group, lcb_treshold=0.35):
     return max_h_row
 
 
-def csv_to_xlsx_with_chart(csv_files, output_filename, days=14, lcb_treshold=0.35, min_dollar_amount=5000):
+def select_rerank_candidates(rerank_candidates_df, lcb_treshold=0.35, min_above_threshold=MIN_ABOVE_THRESHOLD):
     """
-    Combine multiple CSV files into a single XLSX file and add a chart for data in the 'position_bias' sheet.
+    Returns the row with the highest 'lcb' of every fingerprint that has at least `min_above_threshold` rows
+    with an 'lcb' above `lcb_treshold`, with that number of rows in 'no_above_threshold', sorted by fingerprint.
+    Gives the same result as applying process_group to every group, but only uses a grouped count and a sort,
+    ties on 'lcb' keep the first row like idxmax does.
+    """
+    if rerank_candidates_df is None or rerank_candidates_df.empty:
+        return pd.DataFrame()
+
+    fingerprints = rerank_candidates_df['query_fingerprint'].to_numpy()
+    above = (rerank_candidates_df['lcb'] > lcb_treshold).groupby(fingerprints).transform('sum').to_numpy()
+    kept = rerank_candidates_df.assign(no_above_threshold=above)[above >= min_above_threshold]
+
+    kept = kept.sort_values(['query_fingerprint', 'lcb'], ascending=[True, False], kind='stable')
+    return kept.drop_duplicates('query_fingerprint')
+
+
+def combine_rerank_aggregates(parts):
+    """
+    Combines the results of select_rerank_candidates(chunk, lcb_treshold, 0) of every chunk of 'query_reranking'
+    into one row per fingerprint: the row with the highest 'lcb' of all chunks, the first one on ties,
+    and the number of rows above the threshold of all chunks in 'no_above_threshold'.
+    """
+    parts = [part for part in parts if not part.empty]
+    if not parts:
+        return pd.DataFrame()
+
+    combined = pd.concat(parts)
+    above = combined.groupby('query_fingerprint')['no_above_threshold'].transform('sum').to_numpy()
+    combined = combined.assign(no_above_threshold=above)
+    combined = combined.sort_values(['query_fingerprint', 'lcb'], ascending=[True, False], kind='stable')
+    return combined.drop_duplicates('query_fingerprint')
+
+
+def select_aggregated_candidates(rerank_aggregates, rerank_candidates_list, query_uplift, min_above_threshold=MIN_ABOVE_THRESHOLD):
+    """
+    Returns the rerank candidates from the per-fingerprint rows of combine_rerank_aggregates(), the same rows
+    select_rerank_candidates gives for the 'query_reranking' rows of the fingerprints in `rerank_candidates_list`.
+    """
+    if rerank_aggregates is None or rerank_aggregates.empty:
+        return pd.DataFrame()
+
+    kept = rerank_aggregates[rerank_aggregates['query_fingerprint'].isin(rerank_candidates_list)
+                             & (rerank_aggregates['no_above_threshold'] >= min_above_threshold)]
+    if kept.empty:
+        return pd.DataFrame()
+    above = kept['no_above_threshold'].to_numpy()
+    kept = kept.drop(columns='no_above_threshold')
+    return kept.assign(annualized_uplift=kept['query_fingerprint'].map(query_uplift).to_numpy(), no_above_threshold=above)
+
+
+def nth_highest_lcb(rerank_df, n=MIN_ABOVE_THRESHOLD):
+    """
+    Returns the n-th highest 'lcb' of every fingerprint (NaN if it has less than n results).
+    A fingerprint has at least n results above a threshold exactly when this value is above the threshold.
+    """
+    ranked = rerank_df[['query_fingerprint', 'lcb']].sort_values(['query_fingerprint', 'lcb'], ascending=[True, False])
+    ranks = ranked.groupby('query_fingerprint').cumcount()
+    return ranked[ranks == n - 1].set_index('query_fingerprint')['lcb']
+
+
+def sweep_rerank_candidates(insights_df, rerank_df, lcb_tresholds, min_dollar_amounts, min_above_threshold=MIN_ABOVE_THRESHOLD):
+    """
+    Computes the number of rerank candidates and their total uplift for every combination of LCB threshold
+    and minimum dollar amount, with a single sort of the reranking results.
+
+    Args:
+    insights_df (DataFrame): 'query_insights' rows with the annualized uplift column.
+    rerank_df (DataFrame): 'query_reranking' rows, only 'query_fingerprint' and 'lcb' are used.
+    lcb_tresholds (list of float): LCB thresholds to sweep.
+    min_dollar_amounts (list of int): Minimum dollar amounts to sweep.
+    """
+    insights_df = insights_df[insights_df['conversion_rate'] < insights_df['ctr']]
+    uplift = insights_df.drop_duplicates('query_fingerprint', keep='last').set_index('query_fingerprint')[UPLIFT_COL]
+    nth_lcb = nth_highest_lcb(rerank_df[rerank_df['query_fingerprint'].isin(uplift.index)], min_above_threshold)
+    uplift = uplift.reindex(nth_lcb.index).to_numpy()
+    nth_lcb = nth_lcb.to_numpy()
+
+    min_dollar_amounts = np.asarray(min_dollar_amounts)
+    rows = []
+    for lcb_treshold in lcb_tresholds:
+        # one row per dollar amount, one column per fingerprint
+        candidates = (nth_lcb > lcb_treshold) & (uplift > min_dollar_amounts[:, None])
+        counts = candidates.sum(axis=1)
+        totals = np.where(candidates, uplift, 0).sum(axis=1)
+        for min_dollar_amount, count, total in zip(min_dollar_amounts, counts, totals):
+            rows.append({
+                'lcb_treshold': lcb_treshold,
+                'min_dollar_amount': min_dollar_amount,
+                'no_candidates': count,
+                'total_candidate_uplift': total,
+            })
+    return pd.DataFrame(rows, columns=['lcb_treshold', 'min_dollar_amount', 'no_candidates', 'total_candidate_uplift'])
+
+
+def load_sweep_exports(csv_files, days=14, chunksize=CHUNK_ROWS):
+    """
+    Reads only what a threshold sweep needs: the uplift columns of 'query_insights' and the fingerprint
+    and 'lcb' columns of 'query_reranking' for queries with a conversion rate below their CTR.
+    """
+    exports = {get_sheet_name(csv_file): csv_file for csv_file in csv_files}
+    if 'query_insights' not in exports or 'query_reranking' not in exports:
+        raise ValueError("A sweep needs both the query_insights and the query_reranking export.")
+
+    insights_columns = ['query_fingerprint', 'conversion_rate', 'ctr', 'revenue_increase_after_multiplier']
+    insights_df = pd.read_csv(exports['query_insights'], **get_read_options(exports['query_insights'], 'query_insights', insights_columns))
+    insights_df = add_annualized_uplift(insights_df, days)
+    fingerprints = set(insights_df.loc[insights_df['conversion_rate'] < insights_df['ctr'], 'query_fingerprint'])
+
+    rerank_parts = []
+    rerank_options = get_read_options(exports['query_reranking'], 'query_reranking', ['query_fingerprint', 'lcb'])
+    for chunk in pd.read_csv(exports['query_reranking'], chunksize=chunksize, **rerank_options):
+        rerank_parts.append(chunk[chunk['query_fingerprint'].isin(fingerprints)])
+    return insights_df, pd.concat(rerank_parts, ignore_index=True)
+
+
+def parse_values(text, cast):
+    """Parses a comma separated list of values, e.g. '0.3, 0.35' into [0.3, 0.35]."""
+    return [cast(value) for value in text.split(',') if value.strip()]
+
+
+def get_sheet_name(csv_file):
+    """Returns the sheet name for an exported file, e.g. 'query_insights' for '<prefix>_query_insights.csv'."""
+    sheet_name = os.path.splitext(os.path.basename(csv_file))[0]
+    if '_' in sheet_name:
+        sheet_name = '_'.join(sheet_name.split('_')[1:])[:30]
+    return sheet_name
+
+
+def get_read_options(csv_file, sheet_name, columns=None):
+    """
+    Returns the pd.read_csv options for an exported file, with the column types declared in EXPORT_SCHEMAS.
+    Only `columns` are read if given.
+    Raises a ValueError naming the missing columns if the file doesn't have all columns of its schema and `columns`.
+    """
+    schema = EXPORT_SCHEMAS.get(sheet_name, {})
+    header = pd.read_csv(csv_file, nrows=0).columns
+    missing = [c for c in list(schema) + list(columns or []) if c not in header]
+    if missing:
+        raise ValueError(f"{os.path.basename(csv_file)} is missing the column(s) {', '.join(dict.fromkeys(missing))}")
+
+    if columns is None:
+        return {'dtype': schema}
+    return {'dtype': {c: dtype for c, dtype in schema.items() if c in columns}, 'usecols': columns}
+
+
+def cache_key(cache, csv_file, sheet_name):
+    """Returns the key of an exported file in the export cache, depending on its content and how it is parsed."""
+    schema = sorted(EXPORT_SCHEMAS.get(sheet_name, {}).items())
+    return cache.key(csv_file, f"{sheet_name}:{PARSE_VERSION}:{schema}")
+
+
+def read_export(csv_file, sheet_name, cache=None):
+    """Reads a whole exported file into a DataFrame, from the export cache if it was parsed before."""
+    if cache is not None:
+        key = cache_key(cache, csv_file, sheet_name)
+        df = cache.load(key)
+        if df is not None:
+            return df
+
+    df = pd.read_csv(csv_file, **get_read_options(csv_file, sheet_name))
+    if sheet_name == 'position_bias':
+        df = df.sort_values(by=df.columns[0])
+
+    if cache is not None:
+        cache.store(key, df)
+    return df
+
+
+def iter_csv_chunks(csv_file, sheet_name, chunksize=CHUNK_ROWS, cache=None):
+    """
+    Yields the rows of an exported file as DataFrames of at most `chunksize` rows.
+    The 'position_bias' export only has a few rows and is read in one go, as it needs to be sorted.
+    Files found in the export cache are read from there, other files are added to it while they are read.
+    """
+    if sheet_name == 'position_bias':
+        yield read_export(csv_file, sheet_name, cache)
+        return
+
+    if cache is None:
+        yield from pd.read_csv(csv_file, chunksize=chunksize, **get_read_options(csv_file, sheet_name))
+        return
+
+    # an entry evicted by another process or unreadable is parsed again and replaces the cached one
+    key = cache_key(cache, csv_file, sheet_name)
+    table = cache.read_table(key)
+    if table is not None:
+        yield from export_cache.iter_table_chunks(table, chunksize)
+    else:
+        yield from cache.store_chunks(key, pd.read_csv(csv_file, chunksize=chunksize, **get_read_options(csv_file, sheet_name)))
+
+
+def iter_df_chunks(df, chunksize=CHUNK_ROWS):
+    """Yields an already parsed DataFrame in chunks of at most `chunksize` rows."""
+    for start in range(0, max(len(df), 1), chunksize):
+        yield df.iloc[start:start + chunksize]
+
+
+def parse_exports(csv_files, workers, cache=None):
+    """
+    Parses all exported files concurrently in a pool of `workers` processes.
+    Returns a dict mapping each file to a future of its DataFrame, so the files can be consumed in sheet order
+    while the remaining ones are still being parsed.
+    """
+    if not csv_files:  # e.g. all sheets reused from the last run
+        return {}
+    pool = ProcessPoolExecutor(max_workers=min(workers, len(csv_files)))
+    futures = {csv_file: pool.submit(read_export, csv_file, get_sheet_name(csv_file), cache) for csv_file in csv_files}
+    pool.shutdown(wait=False)
+    return futures
+
+
+def add_annualized_uplift(df, days):
+    """Adds the annualized uplift column to a chunk of the 'query_insights' export."""
+    if 'revenue_increase_after_multiplier' in df.columns:
+        df = df.assign(**{UPLIFT_COL: ((df['revenue_increase_after_multiplier'] / days) * 365).astype(int)})
+    return df
+
+
+def max_rss_mb():
+    """Returns the peak resident set size of this process so far in MB, None where it can't be measured."""
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss / 1024 / 1024 if sys.platform == 'darwin' else max_rss / 1024
+
+
+class ReportProfiler:
+    """
+    Records wall time, CPU time, rows and the peak RSS after every step of a report run, e.g. reading or writing
+    a chunk of a file. print_summary() adds the steps up per stage and sheet, write_trace() writes every step
+    in the Chrome trace format (open it in chrome://tracing or https://ui.perfetto.dev).
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.events = []
+
+    @contextmanager
+    def measure(self, stage, sheet_name):
+        """Measures a step of `stage` for a sheet, the step can set the number of rows it handled in event['rows']."""
+        event = {'stage': stage, 'sheet': sheet_name, 'rows': 0}
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield event
+        finally:
+            event['ts'] = wall_start - self.start
+            event['wall_s'] = time.perf_counter() - wall_start
+            event['cpu_s'] = time.process_time() - cpu_start
+            event['max_rss_mb'] = max_rss_mb()
+            self.events.append(event)
+
+    def summary(self):
+        """Returns the steps added up per stage and sheet, in the order they were first measured."""
+        stages = {}
+        for event in self.events:
+            record = stages.setdefault((event['stage'], event['sheet']), {
+                'stage': event['stage'], 'sheet': event['sheet'], 'calls': 0, 'rows': 0, 'wall_s': 0, 'cpu_s': 0,
+            })
+            record['calls'] += 1
+            record['rows'] += event['rows']
+            record['wall_s'] += event['wall_s']
+            record['cpu_s'] += event['cpu_s']
+            record['max_rss_mb'] = event['max_rss_mb']
+        return list(stages.values())
+
+    def print_summary(self):
+        print('')
+        print(f"{'stage':<12} {'sheet':<32} {'calls':>7} {'rows':>10} {'wall s':>9} {'cpu s':>9} {'max RSS MB':>11}")
+        for record in self.summary():
+            max_rss = f"{record['max_rss_mb']:>11.1f}" if record['max_rss_mb'] is not None else f"{'-':>11}"
+            print(f"{record['stage']:<12} {record['sheet']:<32} {record['calls']:>7} {record['rows']:>10} {record['wall_s']:>9.2f} {record['cpu_s']:>9.2f} {max_rss}")
+        print(f"total {time.perf_counter() - self.start:.2f}s")
+
+    def write_trace(self, filename):
+        """Writes every measured step in the Chrome trace format, with the summary per stage and sheet."""
+        trace_events = [{
+            'name': f"{event['stage']} {event['sheet']}",
+            'cat': event['stage'],
+            'ph': 'X',
+            'ts': round(event['ts'] * 1e6),
+            'dur': round(event['wall_s'] * 1e6),
+            'pid': os.getpid(),
+            'tid': 0,
+            'args': {'rows': event['rows'], 'cpu_s': event['cpu_s'], 'max_rss_mb': event['max_rss_mb']},
+        } for event in self.events]
+        with open(filename, 'w') as f:
+            json.dump({'traceEvents': trace_events, 'displayTimeUnit': 'ms', 'summary': self.summary()}, f)
+
+
+class ReportState:
+    """
+    Per-fingerprint aggregates of a previous run, kept in a directory next to the report for incremental runs.
+    For every sheet it stores the content hash of the file it was read from and its number of rows, for
+    AGGREGATED_SHEETS also the aggregates the report is computed from: the INSIGHTS_COLUMNS of 'query_insights'
+    and the row with the highest 'lcb' and the number of rows above the threshold of every 'query_reranking'
+    fingerprint (see combine_rerank_aggregates). Files that didn't change since are not computed again, and not
+    read at all if no output needs their rows (e.g. only the JSON summary).
+
+    Args:
+    directory (str): Directory the state is stored in, created when the first sheet is stored.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.index_file = os.path.join(directory, 'state.json')
+        self.files = {}
+        if os.path.exists(self.index_file):
+            with open(self.index_file) as f:
+                self.files = json.load(f).get('files', {})
+
+    def key(self, csv_file, sheet_name, lcb_treshold):
+        """
+        Returns the hash of a file and of everything its aggregates depend on. The uplift is annualized again on
+        every run, so only the 'query_reranking' aggregates depend on a parameter, the LCB threshold.
+        """
+        params = lcb_treshold if sheet_name == 'query_reranking' else ''
+        return export_cache.file_digest(csv_file, f"{PARSE_VERSION}:{sheet_name}:{EXPORT_SCHEMAS.get(sheet_name, {})}:{params}")
+
+    def aggregates_path(self, sheet_name):
+        return os.path.join(self.directory, f"{sheet_name}.pkl")
+
+    def load(self, sheet_name, key):
+        """Returns the stored aggregates (None for other sheets) and number of rows of a sheet, or None if the file changed."""
+        entry = self.files.get(sheet_name)
+        if entry is None or entry['key'] != key:
+            return None
+        if sheet_name not in AGGREGATED_SHEETS:
+            return None, entry['rows']
+        try:
+            return pd.read_pickle(self.aggregates_path(sheet_name)), entry['rows']
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def store(self, sheet_name, key, rows, aggregates=None):
+        """Stores the aggregates and number of rows of a sheet, they are only used once save() was called."""
+        os.makedirs(self.directory, exist_ok=True)
+        if sheet_name in AGGREGATED_SHEETS:
+            aggregates.to_pickle(self.aggregates_path(sheet_name))
+        self.files[sheet_name] = {'key': key, 'rows': rows}
+
+    def save(self, sheet_names):
+        """Writes the index of the stored sheets, forgetting sheets that aren't part of the report anymore."""
+        self.files = {sheet_name: entry for sheet_name, entry in self.files.items() if sheet_name in sheet_names}
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_file = f"{self.index_file}.tmp"
+        with open(tmp_file, 'w') as f:
+            json.dump({'parse_version': PARSE_VERSION, 'files': self.files}, f, indent=2)
+        os.replace(tmp_file, self.index_file)
+
+
+class ReportModel:
+    """
+    Computed results of a report, independent of the format it is written in.
+
+    Attributes:
+    days, lcb_treshold, min_dollar_amount: Parameters the report was computed with.
+    sheet_rows (dict): Number of rows of every sheet, in sheet order.
+    insights (DataFrame): INSIGHTS_COLUMNS of the 'query_insights' export, including the annualized uplift.
+    rerank_candidates (DataFrame): Rows of the 'rerank_candidates' sheet, empty if no candidates were found.
+    totals (dict): Uplift totals of the 'Summary' sheet.
+    """
+
+    def __init__(self, days, lcb_treshold, min_dollar_amount):
+        self.days = days
+        self.lcb_treshold = lcb_treshold
+        self.min_dollar_amount = min_dollar_amount
+        self.sheet_rows = {}
+        self.insights = None
+        self.rerank_candidates = pd.DataFrame()
+        self.totals = {
+            'total_rev_uplift': 0,
+            'total_search_uplift': 0,
+            'total_browsed_uplift': 0,
+            'total_candidate_uplift': 0,
+        }
+
+    def summary_df(self):
+        """Returns the 'Summary' sheet."""
+        return pd.DataFrame({name: [value] for name, value in self.totals.items()})
+
+    def to_dict(self):
+        """Returns the parameters, totals, sheet sizes and rerank candidates as plain Python values."""
+        return {
+            'parameters': {'days': self.days, 'lcb_treshold': self.lcb_treshold, 'min_dollar_amount': self.min_dollar_amount},
+            'totals': {name: value.item() if hasattr(value, 'item') else value for name, value in self.totals.items()},
+            'sheet_rows': dict(self.sheet_rows),
+            'rerank_candidates': json.loads(self.rerank_candidates.to_json(orient='records')) if not self.rerank_candidates.empty else [],
+        }
+
+
+class ReportWriter:
+    """
+    Writes the report workbook with xlsxwriter in constant memory mode, where rows are flushed to disk as soon as
+    a later row is written. Every sheet is therefore written top to bottom, the formatted header row first and
+    then the rows of one DataFrame after the other. Header formats are created once per background color.
+
+    Like the other report writers it gets the rows of every sheet with write_df() and the computed ReportModel with close().
+
+    Args:
+    filename (str): Path to output XLSX file.
+    """
+
+    needs_rows = True
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.book = xlsxwriter.Workbook(filename, {'constant_memory': True, 'nan_inf_to_errors': True})
+        self.sheets = {}
+        self.rows = {}
+        self.header_formats = {}
+
+    def header_format(self, color):
+        """Returns the header format with the given background color."""
+        if color not in self.header_formats:
+            self.header_formats[color] = self.book.add_format({'bold': True, 'bg_color': color, 'text_wrap': True, 'valign': 'bottom'})
+        return self.header_formats[color]
+
+    def add_sheet(self, sheet_name, columns):
+        """Adds a worksheet with a formatted header row, colors and widths of the columns are taken from header_info."""
+        worksheet = self.book.add_worksheet(sheet_name)
+        self.sheets[sheet_name] = worksheet
+        self.rows[sheet_name] = 0
+        #set row height for header
+        worksheet.set_row(0, HEADER_H)
+        #freeze the first row
+        worksheet.freeze_panes(1, 0)
+
+        for col_num, header in enumerate(columns):
+            h_info = header_info.get(header, {})
+            worksheet.write(0, col_num, header, self.header_format(h_info.get('color', HEADER_BG_COLOR)))
+            worksheet.set_column(col_num, col_num, h_info.get('width', STANDARD_COL_WIDTH))  # Set column width
+        return worksheet
+
+    def write_df(self, sheet_name, df):
+        """
+        Appends the rows of a DataFrame to a sheet, adding the sheet with its header first if needed.
+        Every column is written with the xlsxwriter method for its type, missing values are left blank.
+        """
+        worksheet = self.sheets.get(sheet_name)
+        if worksheet is None:
+            worksheet = self.add_sheet(sheet_name, df.columns)
+
+        columns = []
+        writers = []
+        for _, series in df.items():
+            kind = series.dtype.kind if isinstance(series.dtype, np.dtype) else 'O'
+            if kind in 'biu':
+                columns.append(series.tolist())
+            else:
+                columns.append(series.astype(object).where(series.notna(), None).tolist())
+            if kind == 'b':
+                writers.append(worksheet.write_boolean)
+            elif kind in 'iuf':
+                writers.append(worksheet.write_number)
+            else:
+                writers.append(worksheet.write)
+
+        for row_num, row in enumerate(zip(*columns), self.rows[sheet_name] + 1):
+            for col_num, (write, value) in enumerate(zip(writers, row)):
+                if value is not None:
+                    write(row_num, col_num, value)
+        self.rows[sheet_name] += len(df)
+        return len(df)
+
+    def close(self, model):
+        """Adds the position bias chart, column formats and conditional formats and writes the workbook."""
+        workbook = self.book
+        format_light_red = workbook.add_format({'bg_color': '#FFC7CE'})  # Format for conditional formatting
+        format_light_green = workbook.add_format({'bg_color': '#a4cc9f'})
+        int_format = workbook.add_format({'num_format': '0'})
+
+        # Add a chart to the position_bias sheet if it exists
+        if 'position_bias' in self.sheets:
+            worksheet = self.sheets['position_bias']
+
+            chart = workbook.add_chart({'type': 'column'})
+            chart.add_series({
+                'name': 'Click share',
+                'pos': f'=position_bias!$A$2:$A$11',
+                'values':     f'=position_bias!$E$2:$E$11',
+            })
+            chart.add_series({
+                'name': 'Conversion share',
+                'pos': f'=position_bias!$A$2:$A$11',
+                'values': f'=position_bias!$G$2:$G$11',
+            })
+            chart.set_x_axis({'name': 'Position'})
+            chart.set_y_axis({
+                'name': 'Value',
+                'min': 0,    # Set the minimum value of the y-axis
+                'max': 1,  # Set the maximum value of the y-axis
+                'major_unit': 0.1,  # Set the interval between major ticks on the y-axis
+            })
+            chart.set_title({'name': 'Position Bias'})
+            worksheet.insert_chart('I15', chart)
+
+        if 'query_insights' in self.sheets:
+            # Add conditional formatting to "query_insights" sheet specifically
+            qis = self.sheets['query_insights']
+
+            #set column format of query_fingerprint
+            qis.set_column('C:C', FINGERPRINT_W, int_format)
+            qis.set_column('A:A', DATE_W)
+            qis.set_column('B:B', DATE_W)
+
+            # Apply conditional formatting based on values in column P and O
+            qis.conditional_format(1, 16, self.rows['query_insights'], 16, {
+                'type': 'formula',
+                'criteria': '=Q2<O2',
+                'format': format_light_red
+            })
+
+            qis.conditional_format(1, 32, self.rows['query_insights'], 32, {
+                'type': 'cell',
+                'criteria': '>',
+                'value': model.min_dollar_amount,
+                'format': format_light_green
+            })
+
+        if 'all_queries_top50KByRank' in self.sheets:
+            aq = self.sheets['all_queries_top50KByRank']
+            aq.set_column('C:C', FINGERPRINT_W, int_format)
+
+        if 'query_reranking' in self.sheets:
+            qr = self.sheets['query_reranking']
+            qr.set_column('A:A', FINGERPRINT_W, int_format)
+
+        if 'rerank_candidates' in self.sheets:
+            qrc = self.sheets['rerank_candidates']
+            qrc.set_column('A:A', FINGERPRINT_W, int_format)
+
+        self.book.close()
+
+
+class CsvBundleWriter:
+    """Writes every sheet to its own CSV file in a directory, created with the first sheet."""
+
+    needs_rows = True
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.paths = {}
+
+    def write_df(self, sheet_name, df):
+        header = sheet_name not in self.paths
+        os.makedirs(self.directory, exist_ok=True)
+        self.paths.setdefault(sheet_name, os.path.join(self.directory, f"{sheet_name}.csv"))
+        df.to_csv(self.paths[sheet_name], mode='w' if header else 'a', header=header, index=False)
+
+    def close(self, model):
+        pass
+
+
+class ParquetBundleWriter:
+    """
+    Writes every sheet to its own Parquet file in a directory created with the first sheet, needs the 'pyarrow' package.
+    Chunks are cast to the column types of the first chunk of their sheet. A column whose values can't be cast
+    is widened: integers followed by decimals are stored as floats, other columns as text, e.g. a column that was
+    empty in the first chunk (float) and has text in a later one. The rows written so far are then read back
+    and written again with the new column types.
+    """
+
+    needs_rows = True
+
+    def __init__(self, directory):
+        if pa is None:
+            raise ImportError("Parquet output needs the 'pyarrow' package, install it with: pip install pyarrow")
+        self.directory = directory
+        self.writers = {}
+
+    def path(self, sheet_name):
+        return os.path.join(self.directory, f"{sheet_name}.parquet")
+
+    def write_df(self, sheet_name, df):
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        writer = self.writers.get(sheet_name)
+        if writer is None:
+            os.makedirs(self.directory, exist_ok=True)
+            writer = self.writers[sheet_name] = pq.ParquetWriter(self.path(sheet_name), table.schema)
+        try:
+            table = table.cast(writer.schema)
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+            writer = self.change_types(sheet_name, table)
+            table = table.cast(writer.schema)
+        writer.write_table(table)
+
+    def change_types(self, sheet_name, table):
+        """
+        Rewrites a sheet with the column types of the written rows widened to fit `table`: a column without
+        a type (only empty values so far) takes the type of `table`, other columns that can't be cast are stored
+        as text. Returns the writer of the rewritten file.
+        """
+        writer = self.writers.pop(sheet_name)
+        fields = []
+        for field in writer.schema:
+            column = table.column(field.name)
+            try:
+                column.cast(field.type)
+            except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+                if pa.types.is_null(field.type):
+                    field = field.with_type(column.type)
+                elif pa.types.is_integer(field.type) and pa.types.is_floating(column.type):
+                    field = field.with_type(pa.float64())
+                else:
+                    field = field.with_type(pa.string())
+            fields.append(field)
+        schema = pa.schema(fields)  # without the pandas metadata of the first chunk, its column types are outdated
+        writer.close()
+        written = pq.read_table(self.path(sheet_name)).cast(schema)
+        writer = self.writers[sheet_name] = pq.ParquetWriter(self.path(sheet_name), schema)
+        writer.write_table(written)
+        return writer
+
+    def close(self, model):
+        for writer in self.writers.values():
+            writer.close()
+
+
+class JsonSummaryWriter:
+    """Writes the parameters, totals, sheet sizes and rerank candidates of a report to a JSON file, without the sheet data."""
+
+    needs_rows = False
+
+    def __init__(self, filename):
+        self.filename = filename
+
+    def write_df(self, sheet_name, df):
+        pass
+
+    def close(self, model):
+        with open(self.filename, 'w') as f:
+            json.dump(model.to_dict(), f, indent=2)
+
+
+def get_report_output(output_filename, report_format):
+    """
+    Returns the file of an output format that is written last, so it only exists once the report was written:
+    the workbook, the JSON summary or the 'Summary' sheet of the CSV and Parquet directories.
+    """
+    base = os.path.splitext(output_filename)[0]
+    if report_format == 'csv':
+        return os.path.join(f"{base}_csv", 'Summary.csv')
+    if report_format == 'parquet':
+        return os.path.join(f"{base}_parquet", 'Summary.parquet')
+    if report_format == 'json':
+        return f"{base}_summary.json"
+    return output_filename
+
+
+def get_report_writers(output_filename, formats=('xlsx',)):
+    """
+    Returns the writers for the requested output formats ('xlsx', 'csv', 'parquet' and/or 'json').
+    The workbook is written to `output_filename`, the other outputs next to it: '<name>_csv/' and '<name>_parquet/'
+    directories with a file per sheet and a '<name>_summary.json' file.
+    """
+    base = os.path.splitext(output_filename)[0]
+    writers = []
+    for report_format in formats:
+        if report_format == 'xlsx':
+            writers.append(ReportWriter(output_filename))
+        elif report_format == 'csv':
+            writers.append(CsvBundleWriter(f"{base}_csv"))
+        elif report_format == 'parquet':
+            writers.append(ParquetBundleWriter(f"{base}_parquet"))
+        elif report_format == 'json':
+            writers.append(JsonSummaryWriter(f"{base}_summary.json"))
+        else:
+            raise ValueError(f"Unknown report format '{report_format}', use one of {', '.join(REPORT_FORMATS)}")
+    return writers
+
+
+def compute_report(csv_files, days=14, lcb_treshold=0.35, min_dollar_amount=5000, chunksize=CHUNK_ROWS, workers=1, cache=None, writers=(), profiler=None, state=None):
+    """
+    Computes the uplift totals and rerank candidates of the exported files and returns them as a ReportModel.
+    Exports are streamed in chunks of `chunksize` rows, every chunk is passed on to the `writers` (e.g. a ReportWriter
+    for the workbook) and only the columns needed for the uplift and rerank candidate calculations are kept in memory.
+    The rerank candidates and the summary are written last, then every writer is closed with the computed model.
+    All files are checked against EXPORT_SCHEMAS first, a ValueError is raised before anything is written
+    if columns are missing.
+    With `workers` > 1 all files are parsed in parallel processes first and then written in sheet order,
+    which is faster but keeps the parsed files in memory until they are written.
     
     Args:
     csv_files (list of str): List of paths to CSV files.
-    output_filename (str): Path to output XLSX file.
+    workers (int): Number of processes used to parse the files.
+    cache (ExportCache): Cache of parsed files, files are parsed on every run if None.
+    writers (list): Report writers, the report is only computed if empty.
+    profiler (ReportProfiler): Records the time spent reading, computing and writing every file if given.
+    state (ReportState): Aggregates of a previous run, files that didn't change since are not computed again and
+                         only read if a writer needs their rows. Updated with the aggregates of this run.
     """
-    writer = pd.ExcelWriter(output_filename, engine='xlsxwriter')
-    workbook = writer.book
-    header_format = workbook.add_format({'bold': True, 'bg_color': '#D7E4BC', 'text_wrap': True, 'valign': 'bottom'})
-    format_light_red = workbook.add_format({'bg_color': '#FFC7CE'})  # Format for conditional formatting
-    format_light_green = workbook.add_format({'bg_color': '#a4cc9f'})
-    int_format = workbook.add_format({'num_format': '0'})
+    if profiler is None:
+        profiler = ReportProfiler()
 
-    rerank_candidates_list = []
-    rerank_candidates_df = None
+    for csv_file in csv_files:
+        get_read_options(csv_file, get_sheet_name(csv_file))
 
-    total_rev_uplift = 0
-    total_search_uplift = 0
-    total_candidate_uplift = 0
+    model = ReportModel(days, lcb_treshold, min_dollar_amount)
+    rerank_candidates_list = set()
+    rerank_candidates_df = None
+    rerank_aggregates = None
+    query_uplift = {}
 
     #make sure insights are loaded first
-    csv_files.sort(key=lambda x: 'insights' not in x)
+    csv_files = sorted(csv_files, key=lambda x: 'insights' not in x)
+
+    state_keys = {}
+    stored = {}
+    if state is not None:
+        for csv_file in csv_files:
+            sheet_name = get_sheet_name(csv_file)
+            state_keys[csv_file] = state.key(csv_file, sheet_name, lcb_treshold)
+            stored[csv_file] = state.load(sheet_name, state_keys[csv_file])
+    skipped = set()
+    if not any(writer.needs_rows for writer in writers):
+        skipped = {csv_file for csv_file in csv_files if stored.get(csv_file) is not None}
+
+    parsed = parse_exports([f for f in csv_files if f not in skipped], workers, cache) if workers > 1 else None
     
     for csv_file in csv_files:
-        sheet_name = os.path.splitext(os.path.basename(csv_file))[0]
-        print(f"reading sheet {Colors.GREEN}{sheet_name}{Colors.RESET}")
-        if '_' in sheet_name:
-            sheet_name = '_'.join(sheet_name.split('_')[1:])[:30]
-        df = pd.read_csv(csv_file)
-        if sheet_name == 'position_bias':
-            df = df.sort_values(by=df.columns[0])
-
-        if sheet_name == 'query_insights':
-            if 'revenue_increase_after_multiplier' in df.columns:
-                col_name = 'annualized uplift after multiplier'
-                df[col_name] = ((df['revenue_increase_after_multiplier'] / days) * 365).astype(int)
-            # Get values from column 'C' where 'Q' < 'P' and 'AG' >= 10000
-            
-            rerank_candidates_list = df.loc[(df['conversion_rate'] < df['ctr']) & (df[col_name] > min_dollar_amount), 'query_fingerprint'].tolist()
-            query_uplift = df.set_index('query_fingerprint')[col_name].to_dict()
-            total_rev_uplift = df[col_name].sum()
-
-            search_df = df[df['is_category_page'] == False]
-            total_search_uplift = search_df[col_name].sum()
-
-        if sheet_name == 'query_reranking':
-            rerank_candidates_df = df[df['query_fingerprint'].isin(rerank_candidates_list)].copy()
-            rerank_candidates_df['annualized_uplift'] = rerank_candidates_df['query_fingerprint'].map(query_uplift)
-            
-        
-        df.to_excel(writer, sheet_name=sheet_name, index=False)
-        # Apply the format to the headers with specific background colors
-        for col_num, header in enumerate(df.columns.values):
-            h_info = header_info.get(header)
-            if h_info != None:
-                header_format.set_bg_color(h_info.get('color', '#FFFFFF'))  # Set background color
+        sheet_name = get_sheet_name(csv_file)
+        aggregates = None
+        if stored.get(csv_file) is not None:
+            aggregates, rows = stored[csv_file]
+
+        if csv_file in skipped:
+            print(f"reusing sheet {Colors.GREEN}{os.path.splitext(os.path.basename(csv_file))[0]}{Colors.RESET} from the last run")
+            chunks = []
+        else:
+            print(f"reading sheet {Colors.GREEN}{os.path.splitext(os.path.basename(csv_file))[0]}{Colors.RESET}")
+            if parsed is not None:
+                chunks = iter_df_chunks(parsed.pop(csv_file).result(), chunksize)
             else:
-                h_info = {'color': STANDARD_BG_COLOR, 'width': STANDARD_COL_WIDTH}
-            
-            # Write the header with specific format
-            worksheet = writer.sheets[sheet_name]
-            worksheet.write(0, col_num, header, header_format)
-            worksheet.set_column(col_num, col_num, h_info.get('width', 15))  # Set column width
+                chunks = iter_csv_chunks(csv_file, sheet_name, chunksize, cache)
+
+        insights_parts = []
+        rerank_parts = []
+        model.sheet_rows[sheet_name] = 0
+        chunks = iter(chunks)
+        while True:
+            with profiler.measure('read', sheet_name) as event:
+                chunk = next(chunks, None)
+                event['rows'] = len(chunk) if chunk is not None else 0
+            if chunk is None:
+                break
+
+            with profiler.measure('compute', sheet_name) as event:
+                if sheet_name == 'query_insights':
+                    chunk = add_annualized_uplift(chunk, days)
+                    if aggregates is None:
+                        insights_parts.append(chunk[INSIGHTS_COLUMNS])
+
+                if sheet_name == 'query_reranking' and aggregates is None:
+                    if state is not None:
+                        # keep one row per fingerprint of all fingerprints, the candidates may change on the next run
+                        rerank_parts.append(select_rerank_candidates(chunk, lcb_treshold, 0))
+                    else:
+                        rerank_parts.append(chunk[chunk['query_fingerprint'].isin(rerank_candidates_list)])
+                event['rows'] = len(chunk)
+
+            with profiler.measure('write', sheet_name) as event:
+                for writer in writers:
+                    writer.write_df(sheet_name, chunk)
+                event['rows'] = len(chunk)
+            model.sheet_rows[sheet_name] += len(chunk)
+
+        if csv_file in skipped:
+            model.sheet_rows[sheet_name] = rows
+
+        with profiler.measure('compute', sheet_name):
+            if sheet_name == 'query_insights' and aggregates is not None:
+                model.insights = add_annualized_uplift(aggregates, days)
+            elif sheet_name == 'query_insights' and insights_parts:
+                model.insights = pd.concat(insights_parts, ignore_index=True)
+            if sheet_name == 'query_insights' and model.insights is not None:
+                rerank_candidates_list, query_uplift, totals = summarize_insights(model.insights, min_dollar_amount)
+                model.totals.update(totals)
+
+            if sheet_name == 'query_reranking' and state is not None:
+                rerank_aggregates = aggregates if aggregates is not None else combine_rerank_aggregates(rerank_parts)
+            elif sheet_name == 'query_reranking' and rerank_parts:
+                rerank_candidates_df = pd.concat(rerank_parts)
+                rerank_candidates_df['annualized_uplift'] = rerank_candidates_df['query_fingerprint'].map(query_uplift)
+
+        if state is not None and stored.get(csv_file) is None:
+            if sheet_name == 'query_insights':
+                aggregates = model.insights if model.insights is not None else pd.DataFrame(columns=INSIGHTS_COLUMNS)
+            elif sheet_name == 'query_reranking':
+                aggregates = rerank_aggregates
+            state.store(sheet_name, state_keys[csv_file], model.sheet_rows[sheet_name], aggregates)
 
     print('')
     print(f"{Colors.RED}looking for value ... {Colors.RESET}", end='')
-    # Further filter to find groups with at least 3 entries where 'H' > 0.3
-    # Group by 'A' and filter groups
-    
-    result_groups = rerank_candidates_df.groupby('query_fingerprint').filter(lambda x: (x['lcb'] > lcb_treshold).sum() >= 3)
-    # Apply the function to each group and concatenate the results
-    try:
-        result_df = pd.concat([process_group(group, lcb_treshold) for name, group in result_groups.groupby('query_fingerprint')])
-        total_candidate_uplift = result_df['annualized_uplift'].sum()
-        result_df.to_excel(writer, sheet_name='rerank_candidates', index=False)
-    except:
+    with profiler.measure('candidates', 'rerank_candidates') as event:
+        if rerank_aggregates is not None:
+            model.rerank_candidates = select_aggregated_candidates(rerank_aggregates, rerank_candidates_list, query_uplift)
+        else:
+            model.rerank_candidates = select_rerank_candidates(rerank_candidates_df, lcb_treshold)
+        event['rows'] = len(model.rerank_candidates)
+    if model.rerank_candidates.empty:
         print(f"{Colors.RED}no value found{Colors.RESET}")
-    
+    else:
+        model.totals['total_candidate_uplift'] = model.rerank_candidates['annualized_uplift'].sum()
+        with profiler.measure('write', 'rerank_candidates') as event:
+            for writer in writers:
+                writer.write_df('rerank_candidates', model.rerank_candidates)
+            event['rows'] = len(model.rerank_candidates)
+        model.sheet_rows['rerank_candidates'] = len(model.rerank_candidates)
 
     #add a new sheet for Summary as first sheet
-    summary_data = {
-        'total_rev_uplift': [total_rev_uplift],
-        'total_search_uplift': [total_search_uplift],
-        'total_browsed_uplift': [total_rev_uplift - total_search_uplift], 
-        'total_candidate_uplift': [total_candidate_uplift]
+    summary_df = model.summary_df()
+    with profiler.measure('write', 'Summary') as event:
+        for writer in writers:
+            writer.write_df('Summary', summary_df)
+        event['rows'] = len(summary_df)
+    model.sheet_rows['Summary'] = len(summary_df)
+
+    for writer in writers:
+        with profiler.measure('close', type(writer).__name__):
+            writer.close(model)
+    if state is not None:
+        state.save(model.sheet_rows)
+    print(f"{Colors.BLUE}f{Colors.GREEN}o{Colors.RED}u{Colors.YELLOW}n{Colors.BLUE}d{Colors.GREEN} i{Colors.RED}t!{Colors.RESET}")
+    return model
+
+
+def csv_to_xlsx_with_chart(csv_files, output_filename, days=14, lcb_treshold=0.35, min_dollar_amount=5000, chunksize=CHUNK_ROWS, workers=1, cache=None, formats=('xlsx',), profile=False, trace=False, incremental=False):
+    """
+    Combine multiple CSV files into a single XLSX file and add a chart for data in the 'position_bias' sheet.
+    Other output formats can be written next to it or instead of it, see get_report_writers().
+    Returns the computed ReportModel, see compute_report().
+    
+    Args:
+    csv_files (list of str): List of paths to CSV files.
+    output_filename (str): Path to output XLSX file.
+    formats (list of str): Output formats, 'xlsx', 'csv', 'parquet' and/or 'json'.
+    profile (bool): Print the time spent per stage and file.
+    trace (bool): Write the time spent per stage and file to '<name>_trace.json' in the Chrome trace format.
+    incremental (bool): Keep the aggregates of this run in '<name>_state/' and only compute the files that changed
+                        since the last run, see ReportState.
+    """
+    writers = get_report_writers(output_filename, formats)
+    profiler = ReportProfiler()
+    state = ReportState(f"{os.path.splitext(output_filename)[0]}_state") if incremental else None
+    model = compute_report(csv_files, days, lcb_treshold, min_dollar_amount, chunksize, workers, cache, writers, profiler, state)
+    if profile:
+        profiler.print_summary()
+    if trace:
+        trace_filename = f"{os.path.splitext(output_filename)[0]}_trace.json"
+        profiler.write_trace(trace_filename)
+        print(f"Trace written to {trace_filename}")
+    return model
+
+
+def get_export_files(directory):
+    """Returns the exported files in a directory, .txt exports are read in place like .csv files."""
+    return sorted(os.path.join(directory, f) for f in os.listdir(directory) if f.endswith(('.csv', '.txt')))
+
+
+def build_report(directory, output_filename=None, days=14, lcb_treshold=0.3, min_dollar_amount=5000, use_cache=True, formats=('xlsx',), profile=False, trace=False, incremental=False):
+    """
+    Builds the report of one directory of exported files without asking for anything.
+    The report is written next to the directory and named after it, unless `output_filename` is given.
+    Returns the path of the first requested output, see get_report_output().
+    """
+    directory = os.path.abspath(directory)
+    if output_filename is None:
+        output_filename = os.path.join(os.path.dirname(directory), f"{os.path.basename(directory)}.xlsx")
+
+    csv_files = get_export_files(directory)
+    if not csv_files:
+        raise ValueError(f"No exported files found in {directory}")
+
+    cache = export_cache.ExportCache() if use_cache and export_cache.pa is not None else None
+    csv_to_xlsx_with_chart(csv_files, output_filename, days, lcb_treshold, min_dollar_amount, cache=cache, formats=formats, profile=profile, trace=trace, incremental=incremental)
+    return get_report_output(output_filename, formats[0])
+
+
+def run_batch_report(report):
+    """Builds one report of a batch, returns the path of the report, the time it took and an error message if it failed."""
+    start = time.perf_counter()
+    try:
+        output_filename = build_report(**report)
+        return output_filename, time.perf_counter() - start, None
+    except Exception as e:
+        return report.get('output_filename'), time.perf_counter() - start, f"{type(e).__name__}: {e}"
+
+
+def load_batch_config(paths, defaults=None):
+    """
+    Returns the reports to build for a list of directories and JSON config files.
+    A config file looks like this, every report can override the defaults:
+
+        {
+            "defaults": {"days": 14, "lcb_treshold": 0.3, "min_dollar_amount": 5000},
+            "reports": [
+                {"directory": "exports/prospect_a"},
+                {"directory": "exports/prospect_b", "output_filename": "prospect_b.xlsx", "days": 7}
+            ]
+        }
+    """
+    reports = []
+    for path in paths:
+        if path.endswith('.json'):
+            with open(path) as f:
+                config = json.load(f)
+            config_defaults = {**(defaults or {}), **config.get('defaults', {})}
+            reports.extend({**config_defaults, **report} for report in config['reports'])
+        else:
+            reports.append({**(defaults or {}), 'directory': path})
+    return reports
+
+
+def run_batch(reports, workers=None):
+    """
+    Builds the reports in a pool of `workers` processes and prints the result and time of every report.
+    Returns the number of failed reports.
+    """
+    workers = min(workers or os.cpu_count() or 1, len(reports))
+    print(f"building {len(reports)} reports with {workers} workers...")
+    print('')
+    start = time.perf_counter()
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(run_batch_report, report): i for i, report in enumerate(reports)}
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+
+    failed = 0
+    print('')
+    print("Batch summary:")
+    for i, report in enumerate(reports):
+        output_filename, seconds, error = results[i]
+        if error is None:
+            print(f"  {Colors.GREEN}OK    {Colors.RESET} {report['directory']} -> {output_filename} ({seconds:.1f}s)")
+        else:
+            failed += 1
+            print(f"  {Colors.RED}FAILED{Colors.RESET} {report['directory']} ({seconds:.1f}s): {error}")
+    print(f"{len(reports) - failed} of {len(reports)} reports created in {time.perf_counter() - start:.1f}s")
+    return failed
+
+
+def add_report_arguments(parser):
+    """Adds the report parameters shared by the batch and watch modes to an ArgumentParser."""
+    parser.add_argument('--workers', type=int, default=None, help="number of reports built at the same time (default: number of CPUs)")
+    parser.add_argument('--days', type=int, default=14)
+    parser.add_argument('--lcb-treshold', type=float, default=0.3)
+    parser.add_argument('--min-dollar-amount', type=int, default=5000)
+    parser.add_argument('--no-cache', action='store_true', help="don't use the export cache")
+    parser.add_argument('--formats', default='xlsx', help=f"comma separated output formats: {', '.join(REPORT_FORMATS)} (default: xlsx)")
+    parser.add_argument('--profile', action='store_true', help="print the time spent per stage and file of every report")
+    parser.add_argument('--trace', action='store_true', help="write a Chrome trace of every report next to it")
+    parser.add_argument('--incremental', action='store_true', help="only compute the files that changed since the last run of a report")
+
+
+def get_report_defaults(args):
+    """Returns the report parameters parsed from the arguments of add_report_arguments(), as build_report() arguments."""
+    return {
+        'days': args.days,
+        'lcb_treshold': args.lcb_treshold,
+        'min_dollar_amount': args.min_dollar_amount,
+        'use_cache': not args.no_cache,
+        'formats': parse_values(args.formats, str.strip),
+        'profile': args.profile,
+        'trace': args.trace,
+        'incremental': args.incremental,
     }
 
-    summary_df = pd.DataFrame(summary_data)
-    summary_df.to_excel(writer, sheet_name='Summary', index=False)
 
+def batch_main(argv):
+    """Command line entry point of the batch mode."""
+    parser = argparse.ArgumentParser(prog='create_report.py --batch', description="Build the reports of several export directories.")
+    parser.add_argument('paths', nargs='+', help="directories of exported files and/or JSON config files")
+    add_report_arguments(parser)
+    args = parser.parse_args(argv)
 
-    for ws in writer.sheets:
-        worksheet = writer.sheets[ws]
-        #set row height for header
-        worksheet.set_row(0, HEADER_H)
-        #freeze the first row
-        worksheet.freeze_panes(1, 0)
+    reports = load_batch_config(args.paths, get_report_defaults(args))
+    if not reports:
+        print("No reports to build.")
+        return 0
+    return 1 if run_batch(reports, args.workers) else 0
 
 
-    
-    # Add a chart to the position_bias sheet if it exists
-    if 'position_bias' in writer.sheets:
-        worksheet = writer.sheets['position_bias']
-
-        max_row = len(df) + 1
-        chart = workbook.add_chart({'type': 'column'})
-        chart.add_series({
-            'name': 'Click share',
-            'pos': f'=position_bias!$A$2:$A$11',
-            'values':     f'=position_bias!$E$2:$E$11',
-        })
-        chart.add_series({
-            'name': 'Conversion share',
-            'pos': f'=position_bias!$A$2:$A$11',
-            'values': f'=position_bias!$G$2:$G$11',
-        })
-        chart.set_x_axis({'name': 'Position'})
-        chart.set_y_axis({
-            'name': 'Value',
-            'min': 0,    # Set the minimum value of the y-axis
-            'max': 1,  # Set the maximum value of the y-axis
-            'major_unit': 0.1,  # Set the interval between major ticks on the y-axis
-        })
-        chart.set_title({'name': 'Position Bias'})
-        worksheet.insert_chart('I15', chart)
+def get_export_directories(root):
+    """
+    Returns the subdirectories of `root` containing exported files, leaving out the '<name>_csv', '<name>_parquet'
+    and '<name>_state' directories written next to the report of '<name>'.
+    """
+    subdirectories = set(get_subdirectories(root))
+    directories = []
+    for name in sorted(subdirectories):
+        if any(name.endswith(suffix) and name[:-len(suffix)] in subdirectories for suffix in REPORT_DIR_SUFFIXES):
+            continue
+        if get_export_files(os.path.join(root, name)):
+            directories.append(os.path.join(root, name))
+    return directories
 
-    
 
-    if 'query_insights' in writer.sheets:
-                # Add conditional formatting to "query_insights" sheet specifically
-        qis = writer.sheets['query_insights']
-
-        #set column format of query_fingerprint
-        qis.set_column('C:C', FINGERPRINT_W, int_format)
-        qis.set_column('A:A', DATE_W)
-        qis.set_column('B:B', DATE_W)
-
-
-        # Apply conditional formatting based on values in column P and O
-        qis.conditional_format(1, 16, len(df), 16, {
-            'type': 'formula',
-            'criteria': '=Q2<O2',
-            'format': format_light_red
-        })
-
-        qis.conditional_format(1, 32, len(df), 32, {
-            'type': 'cell',
-            'criteria': '>',
-            'value': min_dollar_amount,
-            'format': format_light_green
-        })
-
-    if 'all_queries_top50KByRank' in writer.sheets:
-        aq = writer.sheets['all_queries_top50KByRank']
-        aq.set_column('C:C', FINGERPRINT_W, int_format)
-        
-
-    if 'query_reranking' in writer.sheets:
-        qr = writer.sheets['query_reranking']
-        qr.set_column('A:A', FINGERPRINT_W, int_format)
-    
-    if 'rerank_candidates' in writer.sheets:
-        qrc = writer.sheets['rerank_candidates']
-        qrc.set_column('A:A', FINGERPRINT_W, int_format)
+def snapshot_exports(directory):
+    """Returns the size and modification time of every exported file of a directory, to notice changes between scans."""
+    snapshot = {}
+    for csv_file in get_export_files(directory):
+        try:
+            stat = os.stat(csv_file)
+        except FileNotFoundError:  # removed since it was listed
+            continue
+        snapshot[csv_file] = (stat.st_size, stat.st_mtime_ns)
+    return snapshot
 
-        
-    writer.close()
-    print(f"{Colors.BLUE}f{Colors.GREEN}o{Colors.RED}u{Colors.YELLOW}n{Colors.BLUE}d{Colors.GREEN} i{Colors.RED}t!{Colors.RESET}")
+
+def is_report_current(directory, snapshot, formats=('xlsx',)):
+    """Returns True if the first output of the report of a directory exists and is newer than all of its exported files."""
+    output_filename = get_report_output(os.path.join(os.path.dirname(directory), f"{os.path.basename(directory)}.xlsx"), formats[0])
+    if not os.path.exists(output_filename):
+        return False
+    return os.stat(output_filename).st_mtime_ns >= max(mtime for _, mtime in snapshot.values())
+
+
+def ignore_interrupt():
+    """Makes a worker process ignore Ctrl+C, so only the main process handles it and waits for running reports."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def watch(root, defaults=None, workers=None, interval=WATCH_INTERVAL, settle=WATCH_SETTLE):
+    """
+    Watches the export subdirectories of `root` and rebuilds the report of a directory when its files change,
+    until interrupted with Ctrl+C. Directories whose report is missing or older than their files are built first.
+
+    The directories are scanned every `interval` seconds. Once the files of a directory changed, its rebuild waits
+    until they stayed unchanged for `settle` seconds, so files that are still being copied or downloaded are
+    not read half written, and a burst of changes causes one rebuild. Every directory is queued at most once
+    and never built twice at the same time, changes during a build queue it again after the build.
+    Reports are built in a pool of `workers` processes like in batch mode, see run_batch_report().
+
+    Args:
+    root (str): Directory containing a subdirectory of exported files per report.
+    defaults (dict): build_report() arguments used for every report, e.g. 'days' or 'formats'.
+    """
+    root = os.path.abspath(root)
+    workers = workers or os.cpu_count() or 1
+    formats = (defaults or {}).get('formats', ('xlsx',))
+    built = {}  # directory -> snapshot of the files its report was built from
+    changed = {}  # directory -> (snapshot, time the snapshot was first seen)
+    queue = []  # directories waiting for a free worker, in the order their files settled
+    running = {}  # future -> (directory, snapshot)
+
+    def log(message):
+        print(f"[{time.strftime('%H:%M:%S')}] {message}")
+
+    log(f"watching {root} with {workers} workers, press Ctrl+C to stop")
+    pool = ProcessPoolExecutor(max_workers=workers, initializer=ignore_interrupt)
+    try:
+        while True:
+            now = time.monotonic()
+            directories = get_export_directories(root)
+            for directory in list(changed):
+                if directory not in directories:  # removed before it settled
+                    changed.pop(directory)
+            queue = [directory for directory in queue if directory in changed]
+
+            busy = {directory for directory, _ in running.values()}
+            for directory in directories:
+                if directory in busy:  # changes during a build are noticed once it finished
+                    continue
+                snapshot = snapshot_exports(directory)
+                if not snapshot:
+                    continue
+                if directory not in built and directory not in changed and is_report_current(directory, snapshot, formats):
+                    built[directory] = snapshot
+                if snapshot == built.get(directory):
+                    changed.pop(directory, None)
+                    if directory in queue:
+                        queue.remove(directory)
+                    continue
+                if directory not in changed or changed[directory][0] != snapshot:
+                    if directory not in changed:
+                        log(f"changes in {os.path.basename(directory)}, waiting for the files to settle")
+                    changed[directory] = (snapshot, now)
+                    if directory in queue:
+                        queue.remove(directory)
+                elif now - changed[directory][1] >= settle and directory not in queue:
+                    queue.append(directory)
+
+            for directory in [d for d in queue if d not in busy][:workers - len(running)]:
+                queue.remove(directory)
+                snapshot = changed.pop(directory)[0]
+                log(f"building {os.path.basename(directory)}")
+                report = {**(defaults or {}), 'directory': directory}
+                running[pool.submit(run_batch_report, report)] = (directory, snapshot)
+
+            for future in [f for f in running if f.done()]:
+                directory, snapshot = running.pop(future)
+                built[directory] = snapshot
+                output_filename, seconds, error = future.result()
+                if error is None:
+                    log(f"{Colors.GREEN}OK    {Colors.RESET} {os.path.basename(directory)} -> {output_filename} ({seconds:.1f}s)")
+                else:
+                    log(f"{Colors.RED}FAILED{Colors.RESET} {os.path.basename(directory)} ({seconds:.1f}s): {error}")
+
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        log("stopping, waiting for running reports...")
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def watch_main(argv):
+    """Command line entry point of the watch mode."""
+    parser = argparse.ArgumentParser(prog='create_report.py --watch', description="Rebuild the reports of export directories as their files change.")
+    parser.add_argument('root', help="directory containing a subdirectory of exported files per report")
+    parser.add_argument('--interval', type=float, default=WATCH_INTERVAL, help=f"seconds between two scans (default: {WATCH_INTERVAL})")
+    parser.add_argument('--settle', type=float, default=WATCH_SETTLE, help=f"seconds files must stay unchanged before a rebuild (default: {WATCH_SETTLE})")
+    add_report_arguments(parser)
+    args = parser.parse_args(argv)
+
+    watch(args.root, get_report_defaults(args), args.workers, args.interval, args.settle)
+    return 0
 
 
 def get_working_directory():
@@ -277,6 +1303,16 @@ def get_working_directory():
 
 if __name__ == "__main__":
 
+    if '--batch' in sys.argv[1:]:
+        sys.exit(batch_main([arg for arg in sys.argv[1:] if arg != '--batch']))
+    if '--watch' in sys.argv[1:]:
+        sys.exit(watch_main([arg for arg in sys.argv[1:] if arg != '--watch']))
+
+    profile = '--profile' in sys.argv
+    trace = '--trace' in sys.argv
+    incremental = '--incremental' in sys.argv
+    sys.argv = [arg for arg in sys.argv if arg not in ('--profile', '--trace', '--incremental')]
+
     days = 14
     lcb_treshold = 0.3
     min_dollar_amount = 5000
@@ -312,21 +1348,47 @@ if __name__ == "__main__":
     else:
         days = 14
 
+    print("Enter a comma separated list of LCB thresholds or dollar amounts to sweep them instead of creating the report.")
     input_lcb_treshold = input(f"Enter the LCB threshold for rerank candidates [{lcb_treshold}]: ")    
     
+    lcb_tresholds = [lcb_treshold]
     if input_lcb_treshold:
         try:
-            lcb_treshold = float(input_lcb_treshold)
+            lcb_tresholds = parse_values(input_lcb_treshold, float) or lcb_tresholds
+            lcb_treshold = lcb_tresholds[0]
         except ValueError:
             print("Invalid input. Using default value of ", lcb_treshold)
 
     input_min_dollar_amount = input("Enter the minimum dollar amount for rerank candidates [5000]: ")
+    min_dollar_amounts = [min_dollar_amount]
     if input_min_dollar_amount:
         try:
-            min_dollar_amount = int(input_min_dollar_amount)
+            min_dollar_amounts = parse_values(input_min_dollar_amount, int) or min_dollar_amounts
+            min_dollar_amount = min_dollar_amounts[0]
         except ValueError:
             print("Invalid input. Using default value of ", min_dollar_amount)
 
+    if len(lcb_tresholds) > 1 or len(min_dollar_amounts) > 1:
+        directory_name = os.path.basename(os.getcwd())
+        sweep_filename = f"{directory_name}_sweep.csv"
+        print('')
+        print("sweeping rerank candidate parameters...")
+        try:
+            insights_df, rerank_df = load_sweep_exports(csv_files, days)
+        except ValueError as e:
+            print(f"{Colors.RED}{e}{Colors.RESET}")
+            sys.exit(1)
+        sweep_df = sweep_rerank_candidates(insights_df, rerank_df, lcb_tresholds, min_dollar_amounts)
+        print(sweep_df.to_string(index=False))
+        sweep_df.to_csv(sweep_filename, index=False)
+        print(f"Created {Colors.GREEN}{sweep_filename}{Colors.RESET}")
+        sys.exit()
+
+    workers = 1
+    parallel = input("Parse the files in parallel? Faster, but needs more memory (yes/no) [no]: ").strip().lower()
+    if parallel == 'yes':
+        workers = os.cpu_count() or 1
+
 
     cwd = os.getcwd()
     directory_name = os.path.basename(cwd)
@@ -334,6 +1396,7 @@ if __name__ == "__main__":
     print('')
     print('')
     output_filename = input(f"Enter output filename or press enter to use '{default_filename}': ").strip() or default_filename
+    formats = parse_values(input(f"Enter the output formats ({', '.join(REPORT_FORMATS)}) [xlsx]: ").lower(), str.strip) or ['xlsx']
     print('')
     print("starting...")
     print('')
@@ -341,8 +1404,16 @@ if __name__ == "__main__":
     if not csv_files:
         print("No CSV files found in the specified directory.")
     else:
-        csv_to_xlsx_with_chart(csv_files, output_filename, days, lcb_treshold, min_dollar_amount)
-        print(f"Created {Colors.GREEN}{output_filename}{Colors.RESET} with sheets and charts where applicable.")
+        cache = None
+        if export_cache.pa is not None:
+            cache = export_cache.ExportCache()
+        else:
+            print("Install 'pyarrow' to cache parsed files for later runs.")
+        try:
+            csv_to_xlsx_with_chart(csv_files, output_filename, days, lcb_treshold, min_dollar_amount, workers=workers, cache=cache, formats=formats, profile=profile, trace=trace, incremental=incremental)
+            print(f"Created {Colors.GREEN}{output_filename}{Colors.RESET} with sheets and charts where applicable.")
+        except ValueError as e:
+            print(f"{Colors.RED}{e}{Colors.RESET}")
     print('')
     print('')
 
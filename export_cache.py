@@ -0,0 +1,169 @@
+## Local cache of parsed radar exports, used by create_report.py to skip parsing files it has seen before.
+## Usage: python export_cache.py [--clear]
+##
+## Parsed exports are stored as uncompressed Arrow IPC files, named after a hash of the file content and the
+## way it was parsed, and are memory-mapped when read back. The least recently used entries are evicted
+## once the cache grows beyond its maximum size.
+##
+## The cache needs the `pyarrow` package, without it create_report.py parses every file as before.
+##
+
+
+import os, sys, hashlib
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+
+# Constants
+CACHE_DIR = os.environ.get('VE_REPORT_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 've_report'))
+CACHE_MAX_MB = int(os.environ.get('VE_REPORT_CACHE_MAX_MB', 2048))  # Maximum size of the cache before entries are evicted
+HASH_BLOCK_SIZE = 1024 * 1024  # Number of bytes hashed at a time
+CACHE_EXT = '.arrow'
+
+
+def file_digest(path, salt=''):
+    """Returns a hash of the content of a file and of `salt`, e.g. a description of how the file is parsed."""
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(str(salt).encode('utf-8'))
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def remove_entry(path):
+    """Removes a cache entry, unless another process sharing the cache directory already did."""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def iter_table_chunks(table, chunksize):
+    """Yields an Arrow table as DataFrames of at most `chunksize` rows, an empty table as one empty DataFrame."""
+    batches = table.to_batches(max_chunksize=chunksize)
+    if not batches:
+        yield table.to_pandas()
+    for batch in batches:
+        yield batch.to_pandas()
+
+
+class ExportCache:
+    """
+    Content addressed cache of parsed exports.
+
+    Args:
+    directory (str): Directory the cache entries are stored in.
+    max_mb (int): Maximum size of the cache in MB, the least recently used entries are evicted beyond that.
+    """
+
+    def __init__(self, directory=CACHE_DIR, max_mb=CACHE_MAX_MB):
+        if pa is None:
+            raise ImportError("The export cache needs the 'pyarrow' package, install it with: pip install pyarrow")
+        self.directory = directory
+        self.max_bytes = max_mb * 1024 * 1024
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, csv_file, schema=''):
+        """Returns the cache key of a file, a hash of its content and of the schema it is parsed with."""
+        return file_digest(csv_file, schema)
+
+    def path(self, key):
+        return os.path.join(self.directory, key + CACHE_EXT)
+
+    def read_table(self, key):
+        """Memory-maps a cached entry and marks it as recently used, returns None if it isn't cached."""
+        path = self.path(key)
+        try:
+            with pa.memory_map(path) as source:
+                table = pa.ipc.open_file(source).read_all()
+            os.utime(path)
+        except (FileNotFoundError, pa.ArrowInvalid):
+            return None
+        return table
+
+    def load(self, key):
+        """Returns a cached DataFrame, or None if it isn't cached."""
+        table = self.read_table(key)
+        return table.to_pandas() if table is not None else None
+
+    def store(self, key, df):
+        """Stores a DataFrame in the cache."""
+        for _ in self.store_chunks(key, [df]):
+            pass
+
+    def store_chunks(self, key, chunks):
+        """
+        Passes DataFrame chunks through while storing them in the cache.
+        The entry only becomes visible once all chunks are written. If a chunk doesn't match the column types
+        of the first one (e.g. a column of integers turning into floats), the file is not cached.
+        """
+        path = self.path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        writer = None
+        schema = None
+        caching = True
+        try:
+            for chunk in chunks:
+                if caching:
+                    try:
+                        table = pa.Table.from_pandas(chunk.reset_index(drop=True), schema=schema, preserve_index=False)
+                        if writer is None:
+                            schema = table.schema
+                            writer = pa.ipc.new_file(tmp_path, schema)
+                        writer.write_table(table)
+                    except (pa.ArrowInvalid, pa.ArrowTypeError, OSError):
+                        caching = False
+                yield chunk
+            if writer is not None and caching:
+                writer.close()
+                writer = None
+                os.replace(tmp_path, path)
+                self.evict()
+        finally:
+            if writer is not None:
+                writer.close()
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def entries(self):
+        """Returns (path, size, last used) of all cached entries, least recently used first."""
+        entries = []
+        for filename in os.listdir(self.directory):
+            if filename.endswith(CACHE_EXT):
+                try:
+                    stat = os.stat(os.path.join(self.directory, filename))
+                except FileNotFoundError:  # evicted by another process, e.g. a worker of --batch
+                    continue
+                entries.append((os.path.join(self.directory, filename), stat.st_size, stat.st_mtime))
+        return sorted(entries, key=lambda entry: entry[2])
+
+    def evict(self):
+        """Removes the least recently used entries until the cache fits its maximum size, keeping the newest one."""
+        entries = self.entries()
+        total_size = sum(size for _, size, _ in entries)
+        for path, size, _ in entries[:-1]:
+            if total_size <= self.max_bytes:
+                break
+            remove_entry(path)
+            total_size -= size
+
+    def clear(self):
+        """Removes all cached entries."""
+        for path, _, _ in self.entries():
+            remove_entry(path)
+
+
+if __name__ == "__main__":
+    cache = ExportCache()
+    if '--clear' in sys.argv[1:]:
+        cache.clear()
+        print(f"Cleared the export cache in {cache.directory}")
+    else:
+        entries = cache.entries()
+        total_size = sum(size for _, size, _ in entries)
+        print(f"Export cache in {cache.directory}: {len(entries)} files, {total_size / 1024 / 1024:.1f} of {CACHE_MAX_MB} MB")
+        print("Run with --clear to remove all cached files.")
@@ -0,0 +1,162 @@
+## This script generates synthetic VE radar exports, to test and benchmark create_report.py without customer data.
+## Usage: python generate_radar_exports.py <output_directory> [--rows 100000] [--seed 0]
+##
+## `--rows` is the number of rows of the largest export, 'query_reranking' (10 results per query). 'query_insights'
+## gets one row per query, 'all_queries_top50KByRank' up to 50K rows and 'position_bias' 20 positions.
+## The columns are laid out like the real exports where create_report.py depends on their position
+## (e.g. 'ctr' in column O and 'conversion_rate' in column Q of 'query_insights'), other columns are made up.
+##
+
+
+import os, argparse
+import numpy as np
+import pandas as pd
+
+
+# Constants
+RESULTS_PER_QUERY = 10  # Rows of 'query_reranking' per query
+TOP_QUERIES = 50000  # Maximum number of rows of 'all_queries_top50KByRank'
+POSITIONS = 20  # Rows of 'position_bias'
+CHUNK_QUERIES = 100000  # Number of queries generated and written at a time
+FILE_PREFIX = 'synthetic'
+
+# Columns A to AF of 'query_insights', create_report.py adds the annualized uplift as column AG
+INSIGHTS_COLUMNS = [
+    'start_date', 'end_date', 'query_fingerprint', 'query', 'is_category_page', 'index_name',
+    'searches', 'users', 'clicks', 'conversions', 'revenue', 'no_results_rate', 'avg_click_position',
+    'click_count', 'ctr', 'add_to_cart_rate', 'conversion_rate', 'avg_order_value', 'revenue_per_search',
+    'expected_ctr', 'expected_conversion_rate', 'ctr_lift', 'conversion_rate_lift', 'expected_clicks',
+    'expected_conversions', 'expected_revenue', 'revenue_increase', 'revenue_increase_pct', 'multiplier',
+    'confidence', 'revenue_after_multiplier', 'revenue_increase_after_multiplier',
+]
+RERANKING_COLUMNS = ['query_fingerprint', 'object_id', 'position', 'new_position', 'clicks', 'conversions', 'lcb', 'ucb']
+POSITION_BIAS_COLUMNS = ['position', 'impressions', 'clicks', 'click_rate', 'click_share', 'conversions', 'conversion_share']
+ALL_QUERIES_COLUMNS = ['rank', 'query', 'query_fingerprint', 'searches', 'users', 'clicks', 'conversions', 'ctr', 'conversion_rate', 'revenue']
+
+
+def generate_insights(rng, fingerprints, first_query):
+    """Returns 'query_insights' rows for the given fingerprints, search volumes follow a long tail."""
+    n = len(fingerprints)
+    searches = np.maximum(1, (rng.pareto(1.2, n) * 20).astype(np.int64))
+    ctr = rng.beta(2, 8, n)
+    conversion_rate = rng.beta(1, 12, n)
+    clicks = (searches * ctr).astype(np.int64)
+    conversions = (searches * conversion_rate).astype(np.int64)
+    revenue = conversions * rng.gamma(2, 30, n)
+    revenue_increase = revenue * rng.uniform(0, 0.4, n)
+    multiplier = rng.uniform(0.5, 1, n)
+    columns = {
+        'start_date': '2024-05-01',
+        'end_date': '2024-05-14',
+        'query_fingerprint': fingerprints,
+        'query': [f"query {i}" for i in range(first_query, first_query + n)],
+        'is_category_page': rng.random(n) < 0.3,
+        'index_name': 'prod_products',
+        'searches': searches,
+        'users': np.maximum(1, (searches * rng.uniform(0.5, 1, n)).astype(np.int64)),
+        'clicks': clicks,
+        'conversions': conversions,
+        'revenue': revenue.round(2),
+        'no_results_rate': rng.beta(1, 30, n).round(4),
+        'avg_click_position': rng.uniform(1, 20, n).round(2),
+        'click_count': clicks,
+        'ctr': ctr.round(4),
+        'add_to_cart_rate': rng.beta(1, 8, n).round(4),
+        'conversion_rate': conversion_rate.round(4),
+        'avg_order_value': rng.gamma(2, 30, n).round(2),
+        'revenue_per_search': (revenue / searches).round(4),
+        'revenue_after_multiplier': (revenue * multiplier).round(2),
+        'revenue_increase_after_multiplier': (revenue_increase * multiplier).round(2),
+    }
+    for column in INSIGHTS_COLUMNS:
+        if column not in columns:
+            columns[column] = rng.random(n).round(4)
+    return pd.DataFrame(columns)[INSIGHTS_COLUMNS]
+
+
+def generate_reranking(rng, fingerprints):
+    """Returns RESULTS_PER_QUERY 'query_reranking' rows per fingerprint."""
+    n = len(fingerprints) * RESULTS_PER_QUERY
+    lcb = rng.beta(2, 5, n)
+    return pd.DataFrame({
+        'query_fingerprint': np.repeat(fingerprints, RESULTS_PER_QUERY),
+        'object_id': rng.integers(1, 10_000_000, n),
+        'position': np.tile(np.arange(1, RESULTS_PER_QUERY + 1), len(fingerprints)),
+        'new_position': rng.integers(1, RESULTS_PER_QUERY + 1, n),
+        'clicks': rng.poisson(5, n),
+        'conversions': rng.poisson(1, n),
+        'lcb': lcb.round(4),
+        'ucb': np.minimum(1, lcb + rng.uniform(0, 0.3, n)).round(4),
+    })[RERANKING_COLUMNS]
+
+
+def generate_position_bias(rng):
+    """Returns the 'position_bias' rows, in the unsorted order of the real export."""
+    impressions = np.full(POSITIONS, 100000)
+    click_rate = 0.3 / np.arange(1, POSITIONS + 1) ** 0.8
+    clicks = (impressions * click_rate).astype(np.int64)
+    conversions = (clicks * rng.uniform(0.05, 0.1, POSITIONS)).astype(np.int64)
+    df = pd.DataFrame({
+        'position': np.arange(1, POSITIONS + 1),
+        'impressions': impressions,
+        'clicks': clicks,
+        'click_rate': click_rate.round(4),
+        'click_share': (clicks / clicks.sum()).round(4),
+        'conversions': conversions,
+        'conversion_share': (conversions / conversions.sum()).round(4),
+    })
+    return df.sample(frac=1, random_state=int(rng.integers(1 << 31)))[POSITION_BIAS_COLUMNS]
+
+
+def generate_all_queries(rng, n):
+    """Returns `n` 'all_queries_top50KByRank' rows."""
+    searches = np.sort(np.maximum(1, (rng.pareto(1.2, n) * 20).astype(np.int64)))[::-1]
+    ctr = rng.beta(2, 8, n)
+    conversion_rate = rng.beta(1, 12, n)
+    return pd.DataFrame({
+        'rank': np.arange(1, n + 1),
+        'query': [f"top query {i}" for i in range(n)],
+        'query_fingerprint': rng.integers(0, np.iinfo(np.uint64).max, n, dtype=np.uint64, endpoint=True),
+        'searches': searches,
+        'users': np.maximum(1, (searches * rng.uniform(0.5, 1, n)).astype(np.int64)),
+        'clicks': (searches * ctr).astype(np.int64),
+        'conversions': (searches * conversion_rate).astype(np.int64),
+        'ctr': ctr.round(4),
+        'conversion_rate': conversion_rate.round(4),
+        'revenue': (searches * conversion_rate * rng.gamma(2, 30, n)).round(2),
+    })[ALL_QUERIES_COLUMNS]
+
+
+def generate_exports(directory, rows=100000, seed=0):
+    """
+    Writes the four synthetic exports to `directory`, with `rows` rows of 'query_reranking'.
+    Queries are generated and written in chunks, so memory doesn't grow with `rows`.
+    Returns the paths of the written files.
+    """
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    paths = {name: os.path.join(directory, f"{FILE_PREFIX}_{name}.csv")
+             for name in ['query_insights', 'query_reranking', 'position_bias', 'all_queries_top50KByRank']}
+
+    queries = max(1, rows // RESULTS_PER_QUERY)
+    for first_query in range(0, queries, CHUNK_QUERIES):
+        n = min(CHUNK_QUERIES, queries - first_query)
+        fingerprints = rng.integers(0, np.iinfo(np.uint64).max, n, dtype=np.uint64, endpoint=True)
+        mode = 'w' if first_query == 0 else 'a'
+        generate_insights(rng, fingerprints, first_query).to_csv(paths['query_insights'], mode=mode, header=mode == 'w', index=False)
+        generate_reranking(rng, fingerprints).to_csv(paths['query_reranking'], mode=mode, header=mode == 'w', index=False)
+
+    generate_position_bias(rng).to_csv(paths['position_bias'], index=False)
+    generate_all_queries(rng, min(rows, TOP_QUERIES)).to_csv(paths['all_queries_top50KByRank'], index=False)
+    return list(paths.values())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic VE radar exports.")
+    parser.add_argument('directory', help="directory the exports are written to")
+    parser.add_argument('--rows', type=int, default=100000, help="rows of the query_reranking export (default: 100000)")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    for path in generate_exports(args.directory, args.rows, args.seed):
+        print(f"Created {path} ({os.path.getsize(path) / 1024 / 1024:.1f} MB)")
@@ -0,0 +1,178 @@
+## Samples search traffic like the one seen by the VE radar, used by the replay mode of send_event.py.
+## Usage: python radar_replay.py <exports_directory> [--samples 1000000]
+##
+## Queries are sampled weighted by their searches in the 'query_insights' export, click and conversion positions
+## from the click and conversion shares of the 'position_bias' export. Both use cumulative arrays searched with
+## a binary search, so sampling millions of events takes a few seconds.
+## Run on its own, the script prints the most searched queries and the position distributions, and checks
+## that sampled frequencies match them.
+##
+
+
+import sys, time, bisect, random, argparse
+import numpy as np
+import pandas as pd
+
+import create_report
+
+
+# Constants
+QUERY_COLUMN = 'query'  # Column of 'query_insights' with the query text
+TRAFFIC_COLUMN = 'searches'  # Column of 'query_insights' the queries are weighted by
+CLICK_SHARE_COLUMN = 'click_share'  # Column of 'position_bias' with the share of clicks per position (column E)
+CONVERSION_SHARE_COLUMN = 'conversion_share'  # Column of 'position_bias' with the share of conversions per position (column G)
+CLICK_SHARE_INDEX = 4  # Position of the click share column, used if it has another name (as in the chart of create_report.py)
+CONVERSION_SHARE_INDEX = 6
+DEFAULT_SAMPLES = 1000000
+
+
+def cumulative(weights):
+    """Returns the cumulative sums of `weights` as float64, negative and missing weights count as 0."""
+    weights = np.nan_to_num(np.asarray(weights, dtype='float64')).clip(min=0)
+    cdf = np.cumsum(weights)
+    if len(cdf) == 0 or cdf[-1] <= 0:
+        raise ValueError("all weights are 0")
+    return cdf
+
+
+class QuerySampler:
+    """
+    Samples queries with probabilities proportional to their weights, many at a time with numpy.
+
+    Args:
+    queries (list): Query texts.
+    weights (list): Weight of every query, e.g. its number of searches.
+    seed (int): Seed of the random numbers, None for a random seed.
+    """
+
+    def __init__(self, queries, weights, seed=None):
+        self.queries = list(queries)
+        self.cdf = cumulative(weights)
+        self.rng = np.random.default_rng(seed)
+
+    def sample(self, n):
+        """Returns `n` queries."""
+        indices = np.searchsorted(self.cdf, self.rng.random(n) * self.cdf[-1], side='right')
+        return [self.queries[i] for i in np.minimum(indices, len(self.queries) - 1)]
+
+
+class PositionSampler:
+    """
+    Samples result positions with probabilities proportional to their shares, one at a time, optionally limited
+    to the positions of the results a search returned.
+
+    Args:
+    positions (list): Positions in ascending order, e.g. 1 to 20.
+    shares (list): Share of the events at every position.
+    seed (int): Seed of the random numbers, None for a random seed.
+    """
+
+    def __init__(self, positions, shares, seed=None):
+        self.positions = [int(position) for position in positions]
+        self.cdf = cumulative(shares).tolist()
+        self.random = random.Random(seed).random
+
+    def sample(self, max_position=None):
+        """Returns a position, at most `max_position` if given (the first position if there are no shares up to it)."""
+        count = len(self.positions)
+        if max_position is not None:
+            count = max(1, bisect.bisect_right(self.positions, max_position))
+        total = self.cdf[count - 1]
+        if total <= 0:
+            return self.positions[0]
+        return self.positions[min(bisect.bisect_right(self.cdf, self.random() * total), count - 1)]
+
+
+def find_export(csv_files, sheet_name):
+    for csv_file in csv_files:
+        if create_report.get_sheet_name(csv_file) == sheet_name:
+            return csv_file
+    raise ValueError(f"no '{sheet_name}' export found")
+
+
+def load_queries(csv_file, traffic_column=TRAFFIC_COLUMN):
+    """Returns the queries of a 'query_insights' export (without category pages) and their traffic, most searched first."""
+    columns = [QUERY_COLUMN, traffic_column, 'is_category_page']
+    df = pd.read_csv(csv_file, keep_default_na=False, na_values={'is_category_page': ['']},
+                     **create_report.get_read_options(csv_file, 'query_insights', columns))
+    df = df[~df['is_category_page'].fillna(True) & (df[QUERY_COLUMN].astype(str).str.strip() != '')]
+    traffic = pd.to_numeric(df[traffic_column], errors='coerce').fillna(0)
+    return traffic.groupby(df[QUERY_COLUMN].astype(str)).sum().sort_values(ascending=False)
+
+
+def share_column(df, name, index):
+    if name in df.columns:
+        return df[name]
+    if len(df.columns) > index:
+        return df.iloc[:, index]
+    raise ValueError(f"the 'position_bias' export has no '{name}' column")
+
+
+def load_positions(csv_file, seed=None):
+    """Returns the click and the conversion PositionSampler of a 'position_bias' export."""
+    df = create_report.read_export(csv_file, 'position_bias')
+    positions = df.iloc[:, 0]
+    clicks = PositionSampler(positions, share_column(df, CLICK_SHARE_COLUMN, CLICK_SHARE_INDEX), seed)
+    conversions = PositionSampler(positions, share_column(df, CONVERSION_SHARE_COLUMN, CONVERSION_SHARE_INDEX),
+                                  None if seed is None else seed + 1)
+    return clicks, conversions
+
+
+def load_replay(directory, seed=None, traffic_column=TRAFFIC_COLUMN):
+    """
+    Returns the QuerySampler, the click PositionSampler and the conversion PositionSampler of a directory of
+    radar exports. Raises a ValueError if an export or a column is missing.
+    """
+    csv_files = create_report.get_export_files(directory)
+    queries = load_queries(find_export(csv_files, 'query_insights'), traffic_column)
+    clicks, conversions = load_positions(find_export(csv_files, 'position_bias'), seed)
+    return QuerySampler(queries.index, queries.values, seed), clicks, conversions
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Sample queries and positions from radar exports like the replay mode of send_event.py.")
+    parser.add_argument('directory', help="directory of the radar exports")
+    parser.add_argument('--samples', type=int, default=DEFAULT_SAMPLES, help=f"number of queries and positions sampled (default: {DEFAULT_SAMPLES})")
+    parser.add_argument('--seed', type=int, default=None, help="seed of the random numbers")
+    parser.add_argument('--traffic-column', default=TRAFFIC_COLUMN, help=f"column of 'query_insights' the queries are weighted by (default: {TRAFFIC_COLUMN})")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    try:
+        query_sampler, clicks, conversions = load_replay(args.directory, args.seed, args.traffic_column)
+    except ValueError as e:
+        print(f"{create_report.Colors.RED}Can't replay {args.directory}: {e}{create_report.Colors.RESET}")
+        return 1
+    print(f"loaded {len(query_sampler.queries)} queries and {len(clicks.positions)} positions in {time.perf_counter() - start:.2f}s")
+
+    start = time.perf_counter()
+    queries = query_sampler.sample(args.samples)
+    query_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    click_positions = [clicks.sample() for _ in range(args.samples)]
+    conversion_positions = [conversions.sample() for _ in range(args.samples)]
+    position_seconds = time.perf_counter() - start
+    print(f"sampled {args.samples} queries in {query_seconds:.2f}s and {2 * args.samples} positions in {position_seconds:.2f}s")
+
+    print('')
+    print("most searched queries: share of searches / share of samples")
+    total = query_sampler.cdf[-1]
+    counts = pd.Series(queries).value_counts()
+    for i, query in enumerate(query_sampler.queries[:10]):
+        weight = query_sampler.cdf[i] - (query_sampler.cdf[i - 1] if i else 0)
+        print(f"  {query[:40]:<40} {weight / total:>8.2%} {counts.get(query, 0) / args.samples:>8.2%}")
+
+    print('')
+    print("position: click share / sampled, conversion share / sampled")
+    click_counts = pd.Series(click_positions).value_counts()
+    conversion_counts = pd.Series(conversion_positions).value_counts()
+    for i, position in enumerate(clicks.positions):
+        click_share = (clicks.cdf[i] - (clicks.cdf[i - 1] if i else 0)) / clicks.cdf[-1]
+        conversion_share = (conversions.cdf[i] - (conversions.cdf[i - 1] if i else 0)) / conversions.cdf[-1]
+        print(f"  {position:>8} {click_share:>8.2%} {click_counts.get(position, 0) / args.samples:>8.2%}"
+              f"   {conversion_share:>8.2%} {conversion_counts.get(position, 0) / args.samples:>8.2%}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
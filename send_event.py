@@ -8,10 +8,22 @@
 ## 
 
 
-from algoliasearch.search_client import SearchClient
-from algoliasearch.insights_client import InsightsClient
+import algolia_clients
 import random
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+
+# Constants
+MAX_EVENTS_PER_REQUEST = 1000  # Maximum number of events the Insights API accepts per request
+FLUSH_INTERVAL = 1  # Seconds after which buffered events are sent, even if there are fewer than MAX_EVENTS_PER_REQUEST
+DEFAULT_EVENTS_PER_SECOND = 100
+QUERIES_PER_REQUEST = 50  # Number of searches per multi-query request when harvesting queryIDs
+LOAD_CONCURRENCY = 8  # Number of searches and event requests running at the same time in a load test
+LOAD_DURATION = 60  # Seconds a load test runs by default
+PROGRESS_INTERVAL = 10  # Seconds between the progress lines of a load test
 
 
 def search(index, userid, query, page=0):
@@ -44,13 +56,356 @@ def send_events(insights_client, user_token, index_name, object_ids, position, q
     print('')
 
 
+def random_user_token(user_token):
+    return f"{user_token}-{random.randint(1, 10000)}-{random.randint(1, 10000)}"
+
+def click_event(user_token, index_name, object_ids, position, query_id):
+    # same event as insights_client.user(user_token).clicked_object_ids_after_search()
+    return {
+        'eventType': 'click',
+        'eventName': 'Click-DRR_enable_v1',
+        'index': index_name,
+        'userToken': user_token,
+        'objectIDs': object_ids,
+        'positions': [position],
+        'queryID': query_id,
+    }
+
+def conversion_event(user_token, index_name, object_ids, query_id):
+    # same event as insights_client.user(user_token).converted_object_ids_after_search()
+    return {
+        'eventType': 'conversion',
+        'eventName': 'Convert-DRR_enable_v1',
+        'index': index_name,
+        'userToken': user_token,
+        'objectIDs': object_ids,
+        'queryID': query_id,
+    }
+
+
+class EventBatcher:
+    """
+    Buffers Insights events and sends them with one request per batch, once `max_events` events are buffered
+    or the oldest buffered event waited `flush_interval` seconds. A background thread flushes on time, so
+    events don't wait for the next one to be added. Events of a failed request are counted and dropped.
+
+    Args:
+    insights_client (InsightsClient): Client the events are sent with.
+    max_events (int): Maximum number of events per request.
+    flush_interval (float): Maximum number of seconds an event is buffered.
+    """
+
+    def __init__(self, insights_client, max_events=MAX_EVENTS_PER_REQUEST, flush_interval=FLUSH_INTERVAL):
+        self.insights_client = insights_client
+        self.max_events = max_events
+        self.flush_interval = flush_interval
+        self.events = []
+        self.first_added = None
+        self.sent = 0
+        self.failed = 0
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.send_lock = threading.Lock()
+        self.closed = threading.Event()
+        self.flusher = threading.Thread(target=self.flush_on_time, daemon=True)
+        self.flusher.start()
+
+    def add(self, event):
+        with self.lock:
+            if not self.events:
+                self.first_added = time.monotonic()
+            self.events.append(event)
+            full = len(self.events) >= self.max_events
+        if full:
+            self.flush()
+
+    def take(self):
+        with self.lock:
+            events = self.events[:self.max_events]
+            self.events = self.events[self.max_events:]
+            self.first_added = time.monotonic() if self.events else None
+        return events
+
+    def flush(self):
+        # the send lock keeps the batches in order and lets a full batch wait for the one being sent
+        with self.send_lock:
+            events = self.take()
+            if not events:
+                return
+            self.requests += 1
+            try:
+                self.insights_client.send_events(events)
+                self.sent += len(events)
+                print(f"  >> {len(events)} events sent, {self.sent} in total.")
+            except Exception as e:
+                self.failed += len(events)
+                print(f"  >> Sending {len(events)} events failed: {e}")
+
+    def flush_on_time(self):
+        while not self.closed.wait(min(self.flush_interval / 4, 0.25)):
+            with self.lock:
+                due = self.first_added is not None and time.monotonic() - self.first_added >= self.flush_interval
+            if due:
+                self.flush()
+
+    def close(self):
+        self.closed.set()
+        self.flusher.join()
+        while self.events:
+            self.flush()
+
+
+class QueryIdPool:
+    """
+    Pool of (user token, queryID, hits) of searches by random users, harvested with one multi-query request
+    of `queries_per_request` searches whenever the pool is empty. Every entry is taken once, so every queryID
+    gets the events of the user who searched.
+
+    Args:
+    client (SearchClient): Client the searches are sent with.
+    index_name (str): Index searched.
+    query (str): Query of every search.
+    user_token (str): Prefix of the random user tokens.
+    queries_per_request (int): Number of searches per multi-query request.
+    query_sampler (QuerySampler): Samples the queries instead, e.g. weighted by traffic (see radar_replay.py).
+    """
+
+    def __init__(self, client, index_name, query, user_token, queries_per_request=QUERIES_PER_REQUEST, query_sampler=None):
+        self.client = client
+        self.index_name = index_name
+        self.query = query
+        self.user_token = user_token
+        self.queries_per_request = queries_per_request
+        self.query_sampler = query_sampler
+        self.entries = []
+        self.requests = 0
+        self.searches = 0
+        self.no_results = 0
+        self.lock = threading.Lock()
+
+    def refill(self):
+        user_tokens = [random_user_token(self.user_token) for _ in range(self.queries_per_request)]
+        if self.query_sampler is not None:
+            query_texts = self.query_sampler.sample(self.queries_per_request)
+        else:
+            query_texts = [self.query] * self.queries_per_request
+        # the user token of every search is a search parameter, the X-Algolia-UserToken header would apply to all of them
+        queries = [{
+            'indexName': self.index_name,
+            'params': urlencode({
+                'query': query,
+                'userToken': token,
+                'clickAnalytics': 'true',
+                'attributesToRetrieve': '["objectID"]',
+            }),
+        } for token, query in zip(user_tokens, query_texts)]
+        response = self.client.multiple_queries(queries)
+        self.requests += 1
+        self.searches += len(queries)
+        for token, result in zip(user_tokens, response['results']):
+            if result['hits'] and result.get('queryID'):
+                self.entries.append((token, result['queryID'], result['hits']))
+            else:
+                self.no_results += 1
+        if not self.entries:
+            raise Exception(f"No results found for {len(queries)} searches in index '{self.index_name}'")
+
+    def take(self):
+        with self.lock:
+            if not self.entries:
+                self.refill()
+            return self.entries.pop()
+
+
+def send_batched_events(pool, insights_client, index_name, events_per_second, max_events=None,
+                        click_positions=None, conversion_positions=None):
+    # buffers a click and a conversion on a random hit of every search of the QueryIdPool, at `events_per_second`
+    # until `max_events` events are generated (or forever), the events are sent in batches.
+    # The positions of the click and the conversion are sampled with `click_positions` and `conversion_positions`
+    # (PositionSamplers, see radar_replay.py) if given, instead of the same random hit for both.
+    batcher = EventBatcher(insights_client)
+    interval = 2 / events_per_second
+    next_search = time.monotonic()
+    generated = 0
+    try:
+        while max_events is None or generated < max_events:
+            try:
+                rand_token, query_id, hits = pool.take()
+                position = random.randint(1, len(hits))
+                conversion_position = position
+                if click_positions is not None:
+                    position = click_positions.sample(len(hits))
+                    conversion_position = conversion_positions.sample(len(hits))
+                batcher.add(click_event(rand_token, index_name, [hits[position - 1]['objectID']], position, query_id))
+                batcher.add(conversion_event(rand_token, index_name, [hits[conversion_position - 1]['objectID']], query_id))
+                generated += 2
+            except Exception as e:
+                print(f"Error: {e}")
+
+            # wait for the next search of the schedule, after a slow search the schedule restarts from now
+            next_search = max(next_search + interval, time.monotonic())
+            time.sleep(max(0, next_search - time.monotonic()))
+    finally:
+        batcher.close()
+        print(f"{batcher.sent} events sent in {batcher.requests} requests, {batcher.failed} events failed.")
+        print(f"{pool.searches} searches in {pool.requests} multi-query requests, {pool.no_results} without results.")
+    return batcher
+
+
+class TokenBucket:
+    """
+    Paces a loop to `rate` acquisitions per second. Up to `burst` tokens are kept, so a loop that was held up
+    (e.g. waiting for a free worker) catches up for a short while instead of losing the time.
+
+    Args:
+    rate (float): Tokens added per second.
+    burst (int): Maximum number of tokens kept.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = 1
+        self.updated = time.monotonic()
+
+    def acquire(self):
+        # blocks until a token is available and takes it
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            time.sleep((1 - self.tokens) / self.rate)
+
+
+class LatencyStats:
+    """Latencies and errors of one kind of call of a load test, shared by the worker threads."""
+
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.errors = {}
+
+    def add(self, seconds, error=None):
+        with self.lock:
+            self.latencies.append(seconds)
+            if error is not None:
+                # errors are counted by HTTP status if there is one, e.g. 429, else by exception type
+                key = str(getattr(error, 'status_code', None) or type(error).__name__)
+                self.errors[key] = self.errors.get(key, 0) + 1
+
+    def percentile(self, latencies, p):
+        # nearest-rank percentile of sorted latencies, in milliseconds
+        if not latencies:
+            return 0
+        return latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))] * 1000
+
+    def summary(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            errors = dict(self.errors)
+        return {
+            'calls': len(latencies),
+            'errors': sum(errors.values()),
+            'errors_by_type': errors,
+            'p50_ms': round(self.percentile(latencies, 50), 2),
+            'p95_ms': round(self.percentile(latencies, 95), 2),
+            'p99_ms': round(self.percentile(latencies, 99), 2),
+        }
+
+    def report(self):
+        summary = self.summary()
+        errors = ', '.join(f"{key}: {count}" for key, count in summary['errors_by_type'].items())
+        print(f"  {self.name:<9} {summary['calls']:>8} calls {summary['errors']:>6} errors"
+              f"   p50 {summary['p50_ms']:>8.1f} ms   p95 {summary['p95_ms']:>8.1f} ms   p99 {summary['p99_ms']:>8.1f} ms"
+              + (f"   ({errors})" if errors else ''))
+
+
+def run_load(index, insights_client, index_name, user_token, query, events_per_second,
+             concurrency=LOAD_CONCURRENCY, duration=LOAD_DURATION, max_events=None):
+    # load test: every task searches as a random user and sends a click and a conversion on a random hit in
+    # one Insights request. Tasks are started at `events_per_second` / 2 per second by a token bucket, with at
+    # most `concurrency` running, so a slow call doesn't hold up the others. Runs for `duration` seconds or
+    # until `max_events` events are scheduled, whatever comes first (None for no limit).
+    search_stats = LatencyStats('search')
+    insights_stats = LatencyStats('insights')
+    bucket = TokenBucket(events_per_second / 2, burst=concurrency)
+    slots = threading.Semaphore(concurrency)
+    sent = [0]
+    sent_lock = threading.Lock()
+
+    def task():
+        try:
+            rand_token = random_user_token(user_token)
+            start = time.perf_counter()
+            try:
+                results = search(index, rand_token, query)
+                search_stats.add(time.perf_counter() - start)
+            except Exception as e:
+                search_stats.add(time.perf_counter() - start, e)
+                return
+            if not results['hits']:
+                return
+            position = random.randint(1, len(results['hits']))
+            object_ids = [results['hits'][position - 1]['objectID']]
+            events = [click_event(rand_token, index_name, object_ids, position, results['queryID']),
+                      conversion_event(rand_token, index_name, object_ids, results['queryID'])]
+            start = time.perf_counter()
+            try:
+                insights_client.send_events(events)
+                insights_stats.add(time.perf_counter() - start)
+                with sent_lock:
+                    sent[0] += len(events)
+            except Exception as e:
+                insights_stats.add(time.perf_counter() - start, e)
+        finally:
+            slots.release()
+
+    print(f"Load test at {events_per_second:g} events/s with {concurrency} concurrent requests, stop with Ctrl+C...")
+    scheduled = 0
+    start = time.monotonic()
+    next_progress = start + PROGRESS_INTERVAL
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        try:
+            while (duration is None or time.monotonic() - start < duration) and (max_events is None or scheduled < max_events):
+                bucket.acquire()
+                slots.acquire()
+                pool.submit(task)
+                scheduled += 2
+                if time.monotonic() >= next_progress:
+                    next_progress += PROGRESS_INTERVAL
+                    print(f"  >> {sent[0]} events sent in {time.monotonic() - start:.0f} seconds")
+        except KeyboardInterrupt:
+            print('Stopping, waiting for the running requests...')
+    elapsed = time.monotonic() - start
+
+    result = {
+        'target_events_per_s': events_per_second,
+        'concurrency': concurrency,
+        'elapsed_s': round(elapsed, 3),
+        'events_sent': sent[0],
+        'events_per_s': round(sent[0] / elapsed, 1) if elapsed else 0,
+        'search': search_stats.summary(),
+        'insights': insights_stats.summary(),
+    }
+    print('')
+    print(f"{sent[0]} events sent in {elapsed:.1f} seconds: {result['events_per_s']:.1f} events/s of {events_per_second:g} targeted")
+    search_stats.report()
+    insights_stats.report()
+    return result
+
+
 def main():
     # User inputs for App ID and API keys
     app_id = input("Enter your Algolia App ID: ")
     admin_api_key = input("Enter your Algolia Admin API Key: ")
     
-    # Connect to Algolia index
-    client = SearchClient.create(app_id, admin_api_key)
+    # Connect to Algolia index, the calls of the clients are measured and printed at the end (see algolia_clients.py)
+    client = algolia_clients.create_search_client(app_id, admin_api_key)
+    algolia_clients.install_metrics_export()
 
     #get a list of all indices and use the first one as default
     indices = client.list_indices()
@@ -94,23 +449,64 @@ def main():
 
     print('')        
     # Event recording setup
-    insights_client = InsightsClient.create(app_id, admin_api_key)
+    insights_client = algolia_clients.create_insights_client(app_id, admin_api_key)
 
     #ask if events should be sent continuously
     continuous = input("Do you want to send events continuously? (yes/no): ") or "no"
-    #ask the user how much time to wait between events
+    #ask how: waiting between events, in batches of the events of many random users, or as a load test
+    mode = "wait"
     if continuous == "yes":
+        print("  wait:    wait a number of seconds between events")
+        print(f"  batched: send the events of many random users in batches of up to {MAX_EVENTS_PER_REQUEST}")
+        print("  load:    load test at a target rate, reporting the latency of the searches and events")
+        print("  replay:  like batched, with the queries and click and conversion positions of radar exports")
+        mode = input("How do you want to send the events? (wait/batched/load/replay, default wait): ") or "wait"
+    time_between_events = 0
+    if mode == "replay":
+        # pandas and numpy are only needed to read the exports, see radar_replay.py
+        import radar_replay
+        replay_directory = input("Enter the path to the directory of the radar exports: ")
+        try:
+            query_sampler, click_positions, conversion_positions = radar_replay.load_replay(replay_directory)
+        except (ValueError, OSError) as e:
+            print(f"Can't replay {replay_directory}: {e}")
+            return
+        print(f"Loaded {len(query_sampler.queries)} queries.")
+    if mode in ("batched", "load", "replay"):
+        events_per_second = float(input(f"Enter the number of events per second (default {DEFAULT_EVENTS_PER_SECOND}): ") or DEFAULT_EVENTS_PER_SECOND)
+    if mode in ("batched", "replay"):
+        queries_per_request = int(input(f"Enter the number of searches per request to get queryIDs (default {QUERIES_PER_REQUEST}): ") or QUERIES_PER_REQUEST)
+    elif mode == "load":
+        concurrency = int(input(f"Enter the number of concurrent requests (default {LOAD_CONCURRENCY}): ") or LOAD_CONCURRENCY)
+        duration = float(input(f"Enter the duration in seconds, 0 for no limit (default {LOAD_DURATION}): ") or LOAD_DURATION) or None
+        max_events = int(input("Enter the maximum number of events, 0 for no limit (default 0): ") or 0) or None
+    elif continuous == "yes":
         time_between_events = int(input("Enter the time between events in seconds (default 90): ") or 90)
-    else:
-        time_between_events = 0
     print('')
 
     
 
-    if continuous == "yes":
+    if continuous == "yes" and mode == "load":
+        run_load(index, insights_client, index_name, user_token, query, events_per_second, concurrency, duration, max_events)
+
+    elif continuous == "yes" and mode == "replay":
+        try:
+            pool = QueryIdPool(client, index_name, query, user_token, queries_per_request, query_sampler)
+            send_batched_events(pool, insights_client, index_name, events_per_second, None, click_positions, conversion_positions)
+        except KeyboardInterrupt:
+            pass
+
+    elif continuous == "yes" and mode == "batched":
+        try:
+            pool = QueryIdPool(client, index_name, query, user_token, queries_per_request)
+            send_batched_events(pool, insights_client, index_name, events_per_second)
+        except KeyboardInterrupt:
+            pass
+
+    elif continuous == "yes":
         while True:
             #create a random user token
-            rand_token = f"{user_token}-{random.randint(1, 10000)}-{random.randint(1, 10000)}"
+            rand_token = random_user_token(user_token)
 
             #search again to get a new queryID
             try: 
@@ -0,0 +1,76 @@
+## Checks select_rerank_candidates() of create_report.py against the original per-group implementation.
+## Usage: python -m pytest test_create_report.py
+##
+
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import create_report
+
+
+# Constants
+LCB_TRESHOLD = 0.35
+
+
+def process_group_candidates(rerank_df, lcb_treshold=LCB_TRESHOLD, min_above_threshold=create_report.MIN_ABOVE_THRESHOLD):
+    """The original implementation: groupby().filter() on the rows above the threshold, then process_group per group."""
+    result_groups = rerank_df.groupby('query_fingerprint').filter(lambda x: (x['lcb'] > lcb_treshold).sum() >= min_above_threshold)
+    groups = [create_report.process_group(group, lcb_treshold) for _, group in result_groups.groupby('query_fingerprint')]
+    return pd.concat(groups) if groups else pd.DataFrame()
+
+
+def assert_same_candidates(rerank_df, **kwargs):
+    expected = process_group_candidates(rerank_df, **kwargs)
+    actual = create_report.select_rerank_candidates(rerank_df, **kwargs)
+    if expected.empty:
+        assert actual.empty
+    else:
+        pd.testing.assert_frame_equal(expected, actual)
+
+
+def random_rerank_df(rng, fingerprints, rows):
+    """Returns 'query_reranking' rows with repeated lcb values (ties), some NaN lcb values and a shuffled index."""
+    df = pd.DataFrame({
+        'query_fingerprint': rng.integers(0, fingerprints, rows).astype('uint64'),
+        'objectID': [f"object-{i}" for i in range(rows)],
+        'lcb': rng.choice(np.round(np.linspace(0, 1, 11), 1), rows),
+    })
+    df.loc[rng.random(rows) < 0.1, 'lcb'] = np.nan
+    df.index = rng.permutation(rows) * 3 + 7
+    return df
+
+
+def test_ties_keep_the_first_row():
+    df = pd.DataFrame({
+        'query_fingerprint': [2, 1, 2, 1, 2, 1, 2],
+        'objectID': ['a', 'b', 'c', 'd', 'e', 'f', 'g'],
+        'lcb': [0.5, 0.9, 0.9, 0.9, 0.9, 0.4, 0.1],
+    }, index=[40, 10, 30, 20, 60, 50, 0])
+    assert_same_candidates(df)
+    assert list(create_report.select_rerank_candidates(df)['objectID']) == ['b', 'c']
+
+
+def test_nan_lcb_values():
+    df = pd.DataFrame({
+        'query_fingerprint': [1, 1, 1, 1, 1, 2, 2, 2, 3, 3],
+        'objectID': ['a', 'b', 'c', 'd', 'e', 'f', 'g', 'h', 'i', 'j'],
+        'lcb': [np.nan, 0.6, 0.5, np.nan, 0.8, 0.9, np.nan, 0.7, np.nan, np.nan],
+    }, index=[8, 3, 5, 1, 9, 7, 0, 2, 6, 4])
+    assert_same_candidates(df)
+    assert list(create_report.select_rerank_candidates(df)['objectID']) == ['e']
+
+
+def test_no_candidates():
+    df = pd.DataFrame({'query_fingerprint': [1, 2], 'objectID': ['a', 'b'], 'lcb': [0.9, 0.1]})
+    assert_same_candidates(df)
+    assert create_report.select_rerank_candidates(None).empty
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_random_frames(seed):
+    rng = np.random.default_rng(seed)
+    df = random_rerank_df(rng, fingerprints=int(rng.integers(1, 200)), rows=int(rng.integers(1, 3000)))
+    assert_same_candidates(df)
+    assert_same_candidates(df, lcb_treshold=0.5, min_above_threshold=1)